@@ -0,0 +1,25 @@
+#!/bin/sh
+set -e
+
+# web (the default): run the app with gunicorn, settings in gunicorn.conf.py
+# migrate: apply migrations and exit, run it once per deploy before starting web
+# matchmaker: the background matchmaker, for MATCHMAKING_BACKGROUND=true
+# anything else is run as is, eg. `docker run <image> python manage.py createsuperuser`
+
+case "$1" in
+    web)
+        if [ "$MIGRATE_ON_START" = "true" ]; then
+            python manage.py migrate --noinput
+        fi
+        exec gunicorn
+        ;;
+    migrate)
+        exec python manage.py migrate --noinput
+        ;;
+    matchmaker)
+        exec python manage.py run_matchmaker
+        ;;
+    *)
+        exec "$@"
+        ;;
+esac
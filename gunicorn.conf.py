@@ -0,0 +1,58 @@
+# gunicorn settings for production, picked up automatically by `gunicorn` in this directory.
+# everything can be changed with environment variables, see the README
+import multiprocessing
+import os
+
+
+def env(name, default):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default):
+    return env(name, str(default)).lower() == "true"
+
+
+# WEB_ASGI=true serves wgl_backend/asgi.py with uvicorn workers, needed for /v1/events
+# and ASYNC_READ_VIEWS. otherwise wgl_backend/wsgi.py with threaded workers, which is faster
+# for plain requests (see the benchmark in the README)
+asgi = env_bool("WEB_ASGI", False)
+
+if asgi:
+    wsgi_app = "wgl_backend.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "wgl_backend.wsgi:application"
+    worker_class = "gthread"
+    threads = int(env("WEB_THREADS", 4))
+
+bind = f"0.0.0.0:{env('PORT', 8000)}"
+
+# WEB_CONCURRENCY is what heroku and friends set, one per core is a good start with threads
+workers = int(env("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# import django and the app once in the master, so workers start fast and share the memory
+preload_app = env_bool("WEB_PRELOAD", True)
+
+# restart workers every so often in case anything leaks, jittered so they don't all go at once
+max_requests = int(env("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+timeout = int(env("WEB_TIMEOUT", 30))
+graceful_timeout = int(env("WEB_GRACEFUL_TIMEOUT", 30))
+# longer than most load balancers' idle timeout, so they close connections first
+keepalive = int(env("WEB_KEEPALIVE", 75))
+
+accesslog = env("WEB_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = env("WEB_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # with preload_app the master imported everything, make sure no database connection
+    # it might've opened ends up shared between workers
+    if not server.cfg.preload_app:
+        return
+
+    from django.db import connections
+
+    connections.close_all()
@@ -17,3 +17,4 @@ admin.site.register(models.Elo)
 admin.site.register(models.Challenge)
 admin.site.register(models.Team, TeamAdmin)
 admin.site.register(models.TeamPlayer)
+admin.site.register(models.QueueState)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class WglApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wgl_api'
+
+    def ready(self):
+        from .computed import install
+
+        install()
@@ -0,0 +1,200 @@
+# async versions of the read-heavy GET endpoints, used instead of the ones in views.py
+# when ASYNC_READ_VIEWS is on (run under asgi.py for that).
+#
+# they send the same json as the sync views but use the async orm, so a request waiting
+# on the database doesn't hold on to a thread. everything else (writes, the browsable api,
+# ?page=<n>) is handed to the sync view
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import views
+from .cache import CATEGORIES, acached, leaderboard_scope
+from .models import Category, Elo, Match, Player
+from .paginations import LeaderboardPagination, MatchPagination, RankingPagination
+from .serializers import (
+    CategorySerializer,
+    EloRowSerializer,
+    MatchRowSerializer,
+    QueuePlayerRowSerializer,
+)
+
+
+def render(data, status=200, etag=None):
+    response = HttpResponse(
+        JSONRenderer().render(data), status=status, content_type="application/json"
+    )
+    response["Vary"] = "Accept"
+
+    if etag is not None:
+        response["ETag"] = etag
+
+    return response
+
+
+def read_view(sync_view):
+    """
+    turn an async function returning a response into a view,
+    with everything that isn't a plain json GET going to `sync_view` instead
+    """
+
+    sync_view = sync_to_async(sync_view.as_view())
+
+    def decorator(get):
+        async def view(request, *args, **kwargs):
+            if (
+                request.method != "GET"
+                or "format" in request.GET
+                or RankingPagination.page_query_param in request.GET
+                or "text/html" in request.headers.get("Accept", "")
+            ):
+                return await sync_view(request, *args, **kwargs)
+
+            try:
+                return await get(Request(request), *args, **kwargs)
+            except Http404:
+                return render({"detail": "Not found."}, status=404)
+            except APIException as exc:
+                # eg. NotFound for a bad cursor, sent like drf's exception handler would
+                detail = exc.detail
+                if not isinstance(detail, (list, dict)):
+                    detail = {"detail": detail}
+                return render(detail, status=exc.status_code)
+
+        # like every drf view, the sync views do their own csrf checks
+        view.csrf_exempt = True
+        return view
+
+    return decorator
+
+
+def check_etag(request, etag):
+    """
+    what the condition() decorator does for ConditionalGetMixin,
+    returns the quoted etag and a 304 if the client already has it (otherwise None).
+    no etag means there's nothing there
+    """
+
+    if etag is None:
+        raise Http404
+
+    etag = quote_etag(etag)
+    return etag, get_conditional_response(request, etag=etag)
+
+
+async def paginated(paginator, request, queryset, serializer_class):
+    rows = await paginator.apaginate_queryset(queryset, request)
+    data = await serializer_class(many=True).ato_representation(rows)
+    return paginator.get_paginated_response(data).data
+
+
+@read_view(views.CategoryList)
+async def category_list(request):
+    async def categories():
+        return CategorySerializer(
+            [category async for category in Category.objects.all()], many=True
+        ).data
+
+    data = await acached(
+        CATEGORIES,
+        request.build_absolute_uri(),
+        None,
+        settings.CACHE_TIMEOUT_CATEGORIES,
+        categories,
+    )
+    return render(data)
+
+
+@read_view(views.LeaderboardDetail)
+async def leaderboard_detail(request, category_id):
+    revision = (
+        await Category.objects.filter(category_id=category_id)
+        .values_list("leaderboard_revision", flat=True)
+        .afirst()
+    )
+    etag = views.leaderboard_etag(category_id, revision)
+    quoted_etag, response = check_etag(request, etag)
+    if response is not None:
+        return response
+
+    async def leaderboard():
+        return await paginated(
+            LeaderboardPagination(),
+            request,
+            Elo.objects.filter(category_id=category_id).values(
+                *EloRowSerializer.values
+            ),
+            EloRowSerializer,
+        )
+
+    # the unquoted etag, like the sync view's cache key
+    data = await acached(
+        leaderboard_scope(category_id),
+        request.build_absolute_uri(),
+        etag,
+        settings.CACHE_TIMEOUT_LEADERBOARD,
+        leaderboard,
+    )
+    return render(data, etag=quoted_etag)
+
+
+@read_view(views.MatchList)
+async def match_list(request):
+    # building the queryset doesn't touch the database, so reuse the sync view's
+    view = views.MatchList(request=request, kwargs={}, format_kwarg=None)
+    queryset = view.get_queryset()
+
+    if not MatchPagination.wanted(request):
+        rows = [row async for row in queryset]
+        return render(await MatchRowSerializer(many=True).ato_representation(rows))
+
+    data = await paginated(MatchPagination(), request, queryset, MatchRowSerializer)
+    return render(data)
+
+
+@read_view(views.MatchDetail)
+async def match_detail(request, match_id):
+    updated = (
+        await Match.objects.filter(match_id=match_id)
+        .values_list("updated_timestamp", flat=True)
+        .afirst()
+    )
+    etag, response = check_etag(request, views.match_etag(match_id, updated))
+    if response is not None:
+        return response
+
+    rows = [
+        row
+        async for row in Match.objects.filter(match_id=match_id).values(
+            *MatchRowSerializer.values
+        )
+    ]
+    if not rows:
+        raise Http404
+
+    data = await MatchRowSerializer(many=True).ato_representation(rows)
+    return render(data[0], etag=etag)
+
+
+@read_view(views.QueueList)
+async def queue_list(request, category_id):
+    if not await Category.objects.filter(category_id=category_id).aexists():
+        raise Http404
+
+    rows = [
+        row
+        async for row in Player.objects.filter(
+            in_queue=True, queues_for=category_id
+        )
+        .order_by("queue_joined_timestamp", "discord_id")
+        .values(*QueuePlayerRowSerializer.values)
+    ]
+
+    data = await QueuePlayerRowSerializer(many=True).ato_representation(rows)
+    return render(data)
@@ -0,0 +1,136 @@
+# response caching for the endpoints that get polled a lot (categories, leaderboards, scores)
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from rest_framework.response import Response
+
+CATEGORIES = "categories"
+
+
+def leaderboard_scope(category_id):
+    return f"leaderboard:{category_id}"
+
+
+def scores_scope(category_id):
+    return f"scores:{category_id}"
+
+
+def scope_version(scope):
+    """
+    every cached response is stored under its scope's current version,
+    so invalidating a scope is just giving it a new version.
+    versions are timestamps so a version that got evicted can't come back
+    and bring old responses with it
+    """
+
+    key = f"version:{scope}"
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+async def ascope_version(scope):
+    key = f"version:{scope}"
+
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+
+    return version
+
+
+def versioned_key(scope, version, url):
+    url_hash = hashlib.md5(url.encode()).hexdigest()
+    return f"response:{scope}:{version}:{url_hash}"
+
+
+def response_key(scope, url):
+    return versioned_key(scope, scope_version(scope), url)
+
+
+async def acached(scope, url, etag, timeout, get_data):
+    """
+    CachedResponseMixin for the async views, `get_data` is an async function
+    returning the response data. uses the same keys, so both share the cache
+    """
+
+    key = versioned_key(scope, await ascope_version(scope), f"{url} {etag}")
+
+    data = await cache.aget(key)
+    if data is None:
+        data = await get_data()
+        await cache.aset(key, data, timeout=timeout)
+
+    return data
+
+
+def invalidate(*scopes):
+    """
+    drop every cached response for `scopes`, once the current transaction commits
+    (so nothing can cache the old data again in between)
+    """
+
+    def bump():
+        cache.set_many(
+            {f"version:{scope}": time.time_ns() for scope in scopes}, timeout=None
+        )
+
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    """
+    cache GET responses of a view, per url, under `get_cache_scope()`.
+    only the response data is cached, it still goes through the renderer.
+
+    if the view also has an etag (see ConditionalGetMixin) it's part of the key,
+    so a cached response can't be sent with a newer etag than its data
+    """
+
+    cache_timeout = 300
+
+    def get_cache_scope(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        url = request.build_absolute_uri()
+        key = response_key(self.get_cache_scope(), f"{url} {getattr(self, 'etag', None)}")
+
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().get(request, *args, **kwargs)
+
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=self.cache_timeout)
+
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    answer GETs with a matching If-None-Match with a 304,
+    before any of the view's queries or serializers run.
+    `get_etag` should be cheap, and return None if there's nothing to compare against
+    """
+
+    def get_etag(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        def etag_func(request, *args, **kwargs):
+            self.etag = self.get_etag(request, *args, **kwargs)
+            return self.etag
+
+        view = condition(etag_func=etag_func)(super().get)
+        return view(request, *args, **kwargs)
@@ -0,0 +1,139 @@
+# batching for django-computedfields.
+#
+# normally every save() resolves the computed fields that depend on the saved row
+# straight away (computedfields' post_save handler), so a request that saves 8 team
+# players goes through the dependency tree 8 times. inside `batch_computed_fields()`
+# those saves are collected instead, and resolved once per model when the batch ends
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_save
+
+from computedfields.handlers import UPDATE_OLD, merge_pk_maps
+from computedfields.handlers import postsave_handler as computedfields_postsave_handler
+from computedfields.resolver import active_resolver
+from computedfields.settings import settings as computedfields_settings
+
+local = threading.local()
+
+
+class ComputedFieldsBatch:
+    def __init__(self):
+        # model -> [pks, changed fields (None if we don't know which)]
+        self.pending = {}
+        # model -> pk map of the old relations, see computedfields' get_old_handler
+        self.old = {}
+        # (function, args) -> None, see run_batched
+        self.calls = {}
+
+        # saves: how many saves would've resolved their dependents on their own
+        # (or run a batched function)
+        # resolves: how many times that was actually done
+        self.stats = {"saves": 0, "resolves": 0}
+
+    @property
+    def avoided(self):
+        return self.stats["saves"] - self.stats["resolves"]
+
+    def add(self, model, instance, update_fields, old):
+        pks, fields = self.pending.setdefault(model, [set(), set()])
+        pks.add(instance.pk)
+
+        if update_fields is None:
+            self.pending[model][1] = None
+        elif fields is not None:
+            fields.update(update_fields)
+
+        if old:
+            merge_pk_maps(self.old.setdefault(model, {}), old)
+
+        self.stats["saves"] += 1
+
+    def add_call(self, function, args):
+        self.calls[(function, args)] = None
+        self.stats["saves"] += 1
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        old, self.old = self.old, {}
+        calls, self.calls = self.calls, {}
+
+        for model, (pks, fields) in pending.items():
+            active_resolver.update_dependent(
+                model._base_manager.filter(pk__in=pks),
+                model,
+                fields,
+                old=old.get(model),
+                update_local=False,
+                querysize=computedfields_settings.COMPUTEDFIELDS_QUERYSIZE,
+            )
+            self.stats["resolves"] += 1
+
+        for function, args in calls:
+            function(*args)
+            self.stats["resolves"] += 1
+
+
+def current_batch():
+    return getattr(local, "batch", None)
+
+
+def run_batched(function, *args):
+    """
+    call `function(*args)` now, or if there's a batch, once when it ends
+    (no matter how many times it was asked for with the same args)
+    """
+
+    batch = current_batch()
+    if batch is None:
+        return function(*args)
+
+    batch.add_call(function, args)
+
+
+@contextmanager
+def batch_computed_fields():
+    """
+    defer resolving dependent computed fields until the block ends,
+    then do it once per model. everything happens in one transaction.
+
+    anything in the block that reads a dependent computed field
+    (eg. Team.score after a team player's score changed) sees the old value,
+    so call `flush()` on the batch first if you need it.
+    nested batches join the outer one
+    """
+
+    batch = current_batch()
+    if batch is not None:
+        yield batch
+        return
+
+    batch = local.batch = ComputedFieldsBatch()
+    try:
+        with transaction.atomic():
+            yield batch
+            batch.flush()
+    finally:
+        local.batch = None
+
+
+def postsave_handler(sender, instance, **kwargs):
+    batch = current_batch()
+
+    # nothing depends on this model, so there's nothing to defer
+    if batch is None or kwargs.get("raw") or sender not in active_resolver._map:
+        return computedfields_postsave_handler(sender, instance, **kwargs)
+
+    batch.add(
+        sender, instance, kwargs.get("update_fields"), UPDATE_OLD.pop(instance, None)
+    )
+
+
+def install():
+    # swap computedfields' post_save handler for the batching one.
+    # computedfields doesn't connect it during migrations, so neither do we
+    if post_save.disconnect(dispatch_uid="COMP_FIELD"):
+        post_save.connect(
+            postsave_handler, sender=None, weak=False, dispatch_uid="COMP_FIELD"
+        )
@@ -1,5 +1,12 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+
 from openskill.models import BradleyTerryFull
 
+from computedfields.models import update_computedfields
+
+from .rankings import refresh_elo_ranks
+
 STARTING_ELO = 1500
 
 MODEL = BradleyTerryFull(
@@ -10,35 +17,91 @@ MODEL = BradleyTerryFull(
 )
 
 
-def calculate_elo(match):
-    teams = [
+def calculate_elo(match, teams=None):
+    """
+    work out everyone's rating after the match from the team places,
+    and save them as `mu_after`/`sigma_after` on the team players
+
+    `teams` can be passed in if they're already loaded
+    """
+
+    from .models import TeamPlayer
+
+    if teams is None:
+        teams = list(match.teams.all())
+
+    # one query for all the players, however many teams there are
+    prefetch_related_objects(teams, "players")
+
+    ratings = [
         [
             MODEL.rating(mu=tp.mu_before, sigma=tp.sigma_before)
             for tp in team.players.all()
         ]
-        for team in match.teams.all()
+        for team in teams
     ]
 
-    ranks = [team.place for team in match.teams.all()]
+    ranks = [team.place for team in teams]
+
+    ratings = MODEL.rate(ratings, ranks=ranks)
 
-    teams = MODEL.rate(teams, ranks=ranks)
+    tps = []
+    for team, team_ratings in zip(teams, ratings):
+        for tp, rating in zip(team.players.all(), team_ratings):
+            tp.mu_after = round(rating.mu)
+            tp.sigma_after = rating.sigma
 
-    for i, team in enumerate(match.teams.all()):
-        for j, tp in enumerate(team.players.all()):
-            tp.mu_after = round(teams[i][j].mu)
-            tp.sigma_after = teams[i][j].sigma
-            tp.save()
+            # mu_delta
+            update_computedfields(tp, ["mu_after", "sigma_after"])
+
+            tps.append(tp)
+
+    TeamPlayer.objects.bulk_update(tps, ["mu_after", "sigma_after", "mu_delta"])
 
 
 def assign_elo(match):
-    from .models import Elo
-
-    for team in match.teams.all():
-        for tp in team.players.all():
-            if tp.mu_after:
-                elo = Elo.objects.filter(
-                    player=tp.player, category=match.category
-                ).first()
-                elo.mu = tp.mu_after
-                elo.sigma = tp.sigma_after
-                elo.save()
+    """
+    commit everyone's `mu_after`/`sigma_after` to their elo for the category
+    """
+
+    from .models import Elo, TeamPlayer
+
+    tps = list(
+        TeamPlayer.objects.filter(
+            match=match, player__isnull=False, mu_after__isnull=False
+        )
+    )
+
+    with transaction.atomic():
+        # lock the rows (in pk order so two matches finishing at once can't deadlock)
+        # so another match finishing with the same players waits for this one
+        elos = {
+            elo.player_id: elo
+            for elo in Elo.objects.select_for_update()
+            .filter(category=match.category_id, player__in=[tp.player_id for tp in tps])
+            .order_by("pk")
+        }
+
+        changed = []
+        mus = []
+        for tp in tps:
+            elo = elos.get(tp.player_id)
+            if elo:
+                # mu_after was worked out from the rating when the match started,
+                # and the player might've finished another match since then.
+                # so apply this match's change to the locked rating instead of overwriting it
+                old_mu = elo.mu
+                elo.mu += tp.mu_after - tp.mu_before
+                elo.sigma = max(
+                    elo.sigma + tp.sigma_after - tp.sigma_before, MODEL.tau
+                )
+                mus += [old_mu, elo.mu]
+                changed.append(elo)
+
+        if not changed:
+            return
+
+        Elo.objects.bulk_update(changed, ["mu", "sigma"])
+
+        # only players between the lowest and highest old/new mu can change rank
+        refresh_elo_ranks(match.category_id, min(mus), max(mus))
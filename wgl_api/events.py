@@ -0,0 +1,113 @@
+# realtime events, so the bot and the website can stop polling /match, /matchmake and /queue.
+#
+# the write paths call `publish()`, which hands the event to the broadcaster once the
+# transaction commits. GET /v1/events streams them out as server-sent events (needs asgi.py)
+import asyncio
+import json
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+MATCH_CREATED = "match.created"
+MATCH_STATUS = "match.status"
+MATCH_SCORES = "match.scores"
+QUEUE_JOINED = "queue.joined"
+QUEUE_LEFT = "queue.left"
+LEADERBOARD_CHANGED = "leaderboard.changed"
+
+
+class Subscription:
+    def __init__(self, broadcaster, max_pending):
+        self.broadcaster = broadcaster
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def put(self, event):
+        # a client that's this far behind loses its oldest events instead of using up memory
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.broadcaster.unsubscribe(self)
+
+
+class InMemoryBroadcaster:
+    """
+    fans events out to the streams connected to this process
+
+    like InMemoryQueueState, every worker only sees the events from its own requests
+    (and run_matchmaker's matches aren't seen at all), so with more than one process
+    this needs swapping for a shared broadcaster, see EVENTS_BROADCASTER
+    """
+
+    max_pending = 100
+
+    def __init__(self):
+        self.subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """
+        start receiving events, has to be called from the event loop that reads them
+
+            with broadcaster.subscribe() as subscription:
+                event = await subscription.get()
+        """
+
+        subscription = Subscription(self, self.max_pending)
+        with self._lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event):
+        # sync views run in worker threads, so hand the event over to each stream's loop
+        with self._lock:
+            subscriptions = list(self.subscriptions)
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # its loop is closed, the stream is gone
+                self.unsubscribe(subscription)
+
+
+@lru_cache
+def _broadcaster(path):
+    return import_string(path)()
+
+
+def get_broadcaster():
+    return _broadcaster(settings.EVENTS_BROADCASTER)
+
+
+def publish(type, **data):
+    """
+    send `{"type": type, **data}` to everyone listening, once the current transaction commits.
+    events only say what changed (ids, statuses), clients fetch the rest like before
+    """
+
+    event = {"type": type, **data}
+    transaction.on_commit(lambda: get_broadcaster().publish(event))
+
+
+def event_matches(event, filters):
+    return all(str(event.get(key)) == value for key, value in filters.items())
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
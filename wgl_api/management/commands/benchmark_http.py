@@ -0,0 +1,143 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wgl_api.models import Category, Match
+
+
+async def read_response(reader):
+    """
+    read one http/1.1 response off a keep-alive connection, returns the status code.
+    just enough http for our own responses (content-length or chunked)
+    """
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {
+        name.strip().lower(): value.strip()
+        for name, _, value in (line.partition(":") for line in lines[1:] if line)
+    }
+
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+
+    return status
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the read endpoints of a running server, "
+        "and print requests/sec and latency percentiles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="where the server is, eg. http://localhost:8000")
+        parser.add_argument(
+            "--concurrency", type=int, default=32, help="connections kept open at once"
+        )
+        parser.add_argument("--duration", type=float, default=10, help="seconds")
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            help="path to request (can be repeated), "
+            "defaults to the category, leaderboard, match and queue endpoints",
+        )
+
+    def default_paths(self):
+        category = Category.objects.order_by("pk").first()
+        match = Match.objects.order_by("-pk").first()
+        if category is None or match is None:
+            raise CommandError("needs a category and a match, or pass --path")
+
+        return [
+            "/v1/category",
+            f"/v1/leaderboard/{category.pk}",
+            "/v1/match",
+            f"/v1/match/{match.pk}",
+            f"/v1/queue/{category.pk}",
+        ]
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        paths = options["paths"] or self.default_paths()
+
+        latencies, errors, elapsed = asyncio.run(
+            self.run(
+                url.hostname,
+                url.port or 80,
+                paths,
+                options["concurrency"],
+                options["duration"],
+            )
+        )
+
+        if not latencies:
+            raise CommandError(f"no successful requests, {errors} errors")
+
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f"paths: {', '.join(paths)}")
+        self.stdout.write(
+            f"{len(latencies)} requests in {elapsed:.1f}s "
+            f"with {options['concurrency']} connections, {errors} errors"
+        )
+        self.stdout.write(f"requests/sec: {len(latencies) / elapsed:.1f}")
+        self.stdout.write(
+            f"latency ms: p50 {percentile(0.5):.1f}, p90 {percentile(0.9):.1f}, "
+            f"p99 {percentile(0.99):.1f}, max {latencies[-1] * 1000:.1f}"
+        )
+
+    async def run(self, host, port, paths, concurrency, duration):
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def client(n):
+            nonlocal errors
+
+            reader, writer = await asyncio.open_connection(host, port)
+            # every connection goes round the paths, starting at a different one
+            i = n
+            try:
+                while time.perf_counter() < deadline:
+                    path = paths[i % len(paths)]
+                    i += 1
+
+                    sent = time.perf_counter()
+                    writer.write(
+                        f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+                        "Accept: application/json\r\n\r\n".encode()
+                    )
+                    try:
+                        status = await read_response(reader)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        # the server closed the connection, open another one
+                        errors += 1
+                        writer.close()
+                        reader, writer = await asyncio.open_connection(host, port)
+                        continue
+
+                    if status == 200:
+                        latencies.append(time.perf_counter() - sent)
+                    else:
+                        errors += 1
+            finally:
+                writer.close()
+
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+
+        return latencies, errors, time.perf_counter() - start
@@ -0,0 +1,140 @@
+import random
+import time
+from itertools import combinations
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from wgl_api.elo import MODEL
+from wgl_api.matchmaking import (
+    MIN_LOBBY_SIZE,
+    MAX_LOBBY_SIZE,
+    LobbyQueue,
+    build_lobbies,
+    score_group,
+    score_groups,
+)
+
+
+def exhaustive_lobbies(ratings, min_size=MIN_LOBBY_SIZE, max_size=MAX_LOBBY_SIZE):
+    """
+    the old matchmaking search: score every combination of players,
+    then keep taking the best one that doesn't reuse anyone
+    """
+
+    by_key = {key: (mu, sigma) for key, mu, sigma in ratings}
+
+    match_to_score = {}
+    for r in range(min_size, min(len(ratings), max_size) + 1):
+        for comb in combinations(by_key, r):
+            match_to_score[comb] = score_group(
+                [by_key[key][0] for key in comb], [by_key[key][1] for key in comb]
+            )
+
+    lobbies = []
+    while match_to_score:
+        best_match = max(match_to_score, key=match_to_score.get)
+        lobbies.append(list(best_match))
+
+        for match in set(match_to_score.keys()):
+            if any(key in match for key in best_match):
+                match_to_score.pop(match)
+
+    return lobbies
+
+
+def total_score(lobbies, ratings):
+    by_key = {key: (mu, sigma) for key, mu, sigma in ratings}
+    return sum(
+        score_group([by_key[key][0] for key in lobby], [by_key[key][1] for key in lobby])
+        for lobby in lobbies
+    )
+
+
+def random_ratings(n, rng):
+    return [
+        (i, round(rng.gauss(MODEL.mu, MODEL.mu / 5)), rng.uniform(50, MODEL.sigma))
+        for i in range(n)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare the lobby builder against the old exhaustive matchmaking search"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[4, 8, 12, 16, 20, 100, 1000, 5000],
+            help="queue sizes to benchmark",
+        )
+        parser.add_argument(
+            "--exhaustive-limit",
+            type=int,
+            default=20,
+            help="largest queue size to run the exhaustive search on",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+
+        self.stdout.write(
+            f"{'players':>8} {'engine':>8} {'time (s)':>10} {'lobbies':>8} {'total score':>12}"
+        )
+
+        for n in options["sizes"]:
+            ratings = random_ratings(n, rng)
+
+            engines = [("lobby", build_lobbies)]
+            if n <= options["exhaustive_limit"]:
+                engines.append(("old", exhaustive_lobbies))
+
+            for name, engine in engines:
+                start = time.perf_counter()
+                lobbies = engine(ratings)
+                elapsed = time.perf_counter() - start
+
+                self.stdout.write(
+                    f"{n:>8} {name:>8} {elapsed:>10.4f} {len(lobbies):>8} "
+                    f"{total_score(lobbies, ratings):>12.2f}"
+                )
+
+        self.stdout.write("")
+        self.stdout.write(f"{'groups':>8} {'scoring':>8} {'time (s)':>10}")
+
+        # scoring on its own, every run of 8 in the biggest queue
+        n = max(options["sizes"])
+        ratings = random_ratings(n, rng)
+        mu = np.array([rating[1] for rating in ratings], dtype=float)
+        sigma = np.array([rating[2] for rating in ratings], dtype=float)
+        groups = np.arange(n - MAX_LOBBY_SIZE + 1)[:, None] + np.arange(MAX_LOBBY_SIZE)
+
+        start = time.perf_counter()
+        for group in groups.tolist():
+            score_group([mu[i] for i in group], [sigma[i] for i in group])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(groups):>8} {'python':>8} {elapsed:>10.4f}")
+
+        start = time.perf_counter()
+        score_groups(mu, sigma, groups)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(groups):>8} {'numpy':>8} {elapsed:>10.4f}")
+
+        self.stdout.write("")
+        self.stdout.write(f"{'players':>8} {'per join (ms)':>14}")
+
+        # one player joining a queue that's already scored
+        for n in options["sizes"]:
+            queue = LobbyQueue()
+            queue.extend(random_ratings(n, rng))
+
+            joins = random_ratings(100, rng)
+            start = time.perf_counter()
+            for key, mu, sigma in joins:
+                queue.add(("join", key), mu, sigma)
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(f"{n:>8} {elapsed / len(joins) * 1000:>14.3f}")
@@ -0,0 +1,151 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wgl_api.models import Category, Elo, Match, Player, TeamPlayer
+from wgl_api.rankings import refresh_elo_ranks, refresh_score_ranks
+from wgl_api.serializers import (
+    EloRowSerializer,
+    EloSerializer,
+    FullPlayerSerializer,
+    MatchRowSerializer,
+    MatchSerializer,
+    QueuePlayerRowSerializer,
+    ScoreRowSerializer,
+    ScoreSerializer,
+)
+from wgl_api.utils import create_match
+from wgl_api.views import with_teams
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the model serializers against the .values() row serializers "
+        "on the list endpoints. everything is rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options["rows"], options["repeat"])
+            transaction.set_rollback(True)
+
+    def make_rows(self, n):
+        category = Category.objects.create(
+            shortcode="benchmark", category_name="Benchmark"
+        )
+
+        players = Player.objects.bulk_create(
+            [
+                Player(discord_id=10**15 + i, username=f"benchmark{i}", in_queue=True)
+                for i in range(n)
+            ]
+        )
+        Player.queues_for.through.objects.bulk_create(
+            [
+                Player.queues_for.through(player_id=player.pk, category_id=category.pk)
+                for player in players
+            ]
+        )
+        Elo.objects.bulk_create(
+            [
+                Elo(player=player, category=category, mu=1000 + i % 1000)
+                for i, player in enumerate(players)
+            ]
+        )
+        refresh_elo_ranks(category.pk)
+
+        # n matches of 2 players, so there's n matches and 2n scores
+        for i in range(n):
+            create_match(
+                [[players[i]], [players[(i + 1) % n]]],
+                category,
+            )
+        TeamPlayer.objects.filter(category=category).update(
+            score=100, match_finished=True
+        )
+        Match.objects.filter(category=category).update(status="Finished")
+        refresh_score_ranks(category.pk)
+
+        return category
+
+    def run(self, n, repeat):
+        self.stdout.write(f"creating {n} rows of each...")
+        category = self.make_rows(n)
+
+        endpoints = [
+            (
+                "match",
+                MatchSerializer,
+                MatchRowSerializer,
+                with_teams(Match.objects.filter(category=category)),
+                Match.objects.filter(category=category),
+            ),
+            (
+                "leaderboard",
+                EloSerializer,
+                EloRowSerializer,
+                Elo.objects.filter(category=category).select_related(
+                    "player__youtube"
+                ),
+                Elo.objects.filter(category=category),
+            ),
+            (
+                "scores",
+                ScoreSerializer,
+                ScoreRowSerializer,
+                TeamPlayer.objects.filter(category=category).select_related(
+                    "player__youtube", "category"
+                ),
+                TeamPlayer.objects.filter(category=category),
+            ),
+            (
+                "queue",
+                FullPlayerSerializer,
+                QueuePlayerRowSerializer,
+                Player.objects.filter(queues_for=category)
+                .select_related("youtube")
+                .prefetch_related("queues_for"),
+                Player.objects.filter(queues_for=category),
+            ),
+        ]
+
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'endpoint':>12} {'serializer':>10} {'rows':>6} "
+            f"{'ms per 1000 rows':>17}"
+        )
+
+        for name, serializer, row_serializer, queryset, row_queryset in endpoints:
+            results = [
+                ("model", lambda: serializer(queryset[:n], many=True).data),
+                (
+                    "rows",
+                    lambda: row_serializer(
+                        row_queryset.values(*row_serializer.values)[:n], many=True
+                    ).data,
+                ),
+            ]
+
+            for label, serialize in results:
+                # best of a few runs, queries included since the row serializers
+                # do some of their own
+                data, elapsed = min(
+                    (timed(serialize) for _ in range(repeat)),
+                    key=lambda result: result[1],
+                )
+
+                self.stdout.write(
+                    f"{name:>12} {label:>10} {len(data):>6} "
+                    f"{elapsed / len(data) * 1000 * 1000:>17.1f}"
+                )
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from wgl_api.matchmaking import Matchmaker
+
+
+class Command(BaseCommand):
+    help = "Run matchmaking in the background every tick instead of on GET /matchmake"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tick",
+            type=float,
+            default=settings.MATCHMAKING_TICK_SECONDS,
+            help="seconds between matchmaking passes",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="run a single matchmaking pass and exit",
+        )
+
+    def handle(self, *args, **options):
+        matchmaker = Matchmaker()
+
+        while True:
+            start = time.monotonic()
+
+            # the connection can go stale between ticks
+            close_old_connections()
+
+            try:
+                matches = list(matchmaker.matchmake())
+            except Exception as e:
+                # keep the worker alive, the next tick will try again
+                self.stderr.write(f"matchmaking failed: {e!r}")
+            else:
+                for match in matches:
+                    self.stdout.write(f"created match {match}")
+
+            if options["once"]:
+                return
+
+            time.sleep(max(0, options["tick"] - (time.monotonic() - start)))
@@ -1,124 +1,500 @@
 # return a queryset with good matches based on who's queuing
-from .utils import create_match
-from .models import Elo, Player, Match, Category
+import logging
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .utils import create_match, QueryCounter
+from .models import Elo, Player, Match
+from .queue_state import get_queue_state, category_bucket
+
+import bisect
+import heapq
+import random
+
+import numpy as np
 
-from itertools import combinations
 from .elo import MODEL
 
 
+logger = logging.getLogger(__name__)
+
+MIN_LOBBY_SIZE = 2
+MAX_LOBBY_SIZE = 8
+
+
 def stdev(values):
     mean = sum(values) / len(values)
     return (sum((x - mean) ** 2 for x in values) / len(values)) ** 0.5
 
 
-class Matchmaker:
-    def __init__(self):
-        self.counter = 0
+def score_group(mus, sigmas):
+    """
+    also for now let's make it simple and do a formula that only takes into account
 
-    def score(self, players, elos, category):
-        """
-        also for now let's make it simple and do a formula that only takes into account
+    - number of players (more = good)
+    - stdev of elo (less = good)
+    - stdev of sigma values (less = good)
+    """
+
+    n = len(mus)
+    try:
+        mu_stdev = stdev(mus)
+    except ZeroDivisionError:
+        mu_stdev = 0
+
+    try:
+        sigma_stdev = stdev(sigmas)
+    except ZeroDivisionError:
+        sigma_stdev = 0
+
+    # normalize stdevs with starting values
+    mu_stdev = mu_stdev / MODEL.mu
+    sigma_stdev = sigma_stdev / MODEL.sigma
+
+    # i have no idea if this is gonna work well so we'll see
+    score = n**2 / (mu_stdev + (sigma_stdev / 5) + 1)
+
+    return score
+
+
+def score_groups(mu, sigma, groups):
+    """
+    same formula as `score_group` but for a lot of groups at once
+
+    `mu` and `sigma` are arrays with one entry per player in the category,
+    `groups` is a 2d array of indexes into them with one row per group.
+    every group has to be the same size, call this once per size.
+    """
+
+    groups = np.asarray(groups, dtype=np.intp)
+    if groups.size == 0:
+        return np.empty(len(groups))
+
+    n = groups.shape[1]
+
+    # normalize stdevs with starting values
+    mu_stdev = np.std(mu[groups], axis=1) / MODEL.mu
+    sigma_stdev = np.std(sigma[groups], axis=1) / MODEL.sigma
+
+    return n**2 / (mu_stdev + (sigma_stdev / 5) + 1)
+
+
+class LobbyQueue:
+    """
+    the players queuing for one category sorted by mu, plus a heap of
+    candidate lobbies that gets updated as players join and leave
+
+    the lowest stdev group of a given size is always a run of neighbours once
+    players are sorted by mu, so only runs get scored: the runs a player is
+    part of when they join, and the runs that bridge the gap when players
+    leave. the work per queue event only depends on the players around it,
+    not on how many people are queuing.
+
+    players are identified by a hashable `key` (the player's pk in the matchmaker)
+    """
+
+    def __init__(self, min_size=MIN_LOBBY_SIZE, max_size=MAX_LOBBY_SIZE):
+        self.min_size = min_size
+        self.max_size = max_size
+
+        # (mu, seq) sorted ascending, seq breaks ties between equal mus
+        self.order = []
+        # seq -> (key, mu, sigma)
+        self.entries = {}
+        # key -> seq
+        self.seqs = {}
+        self.next_seq = 0
+
+        # (-score, seqs of a run), can contain runs that aren't valid anymore
+        self.heap = []
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, key):
+        return key in self.seqs
+
+    def keys(self):
+        return list(self.seqs)
+
+    def rating(self, key):
+        _, mu, sigma = self.entries[self.seqs[key]]
+        return mu, sigma
+
+    def _position(self, seq):
+        return bisect.bisect_left(self.order, (self.entries[seq][1], seq))
+
+    def _is_run(self, group):
+        # still queuing and nobody joined in between since it was scored
+        if not all(seq in self.entries for seq in group):
+            return False
+
+        start = self._position(group[0])
+        return all(
+            start + i < len(self.order) and self.order[start + i][1] == seq
+            for i, seq in enumerate(group)
+        )
+
+    def _push(self, groups):
+        by_size = {}
+        for group in groups:
+            by_size.setdefault(len(group), []).append(group)
+
+        for size, groups in by_size.items():
+            mu = np.array([self.entries[seq][1] for group in groups for seq in group])
+            sigma = np.array(
+                [self.entries[seq][2] for group in groups for seq in group]
+            )
+            indexes = np.arange(len(groups) * size).reshape(len(groups), size)
+
+            # heapq is a min heap, ties go to the lowest rated group
+            scores = score_groups(mu, sigma, indexes).tolist()
+            for score, group in zip(scores, groups):
+                heapq.heappush(self.heap, (-score, tuple(group)))
+
+        # runs that aren't valid anymore only get dropped when popped,
+        # so clean up once in a while
+        if len(self.heap) > 64 * (len(self.order) + 16):
+            self.heap = [entry for entry in self.heap if self._is_run(entry[1])]
+            heapq.heapify(self.heap)
+
+    def _bridge(self, position):
+        """score the runs across the gap left at `position` by players leaving"""
+
+        # players left of the gap, closest first
+        lefts = [
+            seq for _, seq in self.order[max(0, position - self.max_size + 1) : position]
+        ][::-1]
+
+        # players right of the gap, closest first
+        rights = [seq for _, seq in self.order[position : position + self.max_size - 1]]
+
+        groups = []
+        for num_left in range(1, len(lefts) + 1):
+            for num_right in range(1, len(rights) + 1):
+                size = num_left + num_right
+                if self.min_size <= size <= self.max_size:
+                    groups.append(lefts[:num_left][::-1] + rights[:num_right])
+
+        self._push(groups)
+
+    def _discard(self, key):
+        seq = self.seqs.pop(key)
+        position = self._position(seq)
+        del self.order[position]
+        del self.entries[seq]
+        return position
+
+    def _new_entry(self, key, mu, sigma):
+        seq = self.next_seq
+        self.next_seq += 1
+
+        self.entries[seq] = (key, mu, sigma)
+        self.seqs[key] = seq
+        return seq
+
+    def add(self, key, mu, sigma):
+        if key in self:
+            self.remove(key)
+
+        seq = self._new_entry(key, mu, sigma)
+        position = bisect.bisect_left(self.order, (mu, seq))
+        self.order.insert(position, (mu, seq))
+
+        # every run the new player is part of
+        groups = []
+        for size in range(self.min_size, self.max_size + 1):
+            first = max(0, position - size + 1)
+            last = min(position, len(self.order) - size)
+            for start in range(first, last + 1):
+                groups.append([seq for _, seq in self.order[start : start + size]])
+
+        self._push(groups)
+
+    def extend(self, ratings):
+        """add a list of (key, mu, sigma)"""
+
+        if self.order:
+            for key, mu, sigma in ratings:
+                self.add(key, mu, sigma)
+            return
+
+        # starting from nothing, score every run at once, one batch per size
+        for key, mu, sigma in ratings:
+            self._new_entry(key, mu, sigma)
+        self.order = sorted((mu, seq) for seq, (_, mu, _) in self.entries.items())
+
+        n = len(self.order)
+        seqs = np.array([seq for _, seq in self.order], dtype=np.intp)
+        mu = np.array([mu for mu, _ in self.order], dtype=float)
+        sigma = np.array([self.entries[seq][2] for seq in seqs.tolist()], dtype=float)
 
-        - number of players (more = good)
-        - stdev of elo (less = good)
-        - stdev of sigma values (less = good)
+        for size in range(self.min_size, min(n, self.max_size) + 1):
+            runs = np.arange(n - size + 1)[:, None] + np.arange(size)
+            scores = score_groups(mu, sigma, runs).tolist()
+            self.heap.extend(zip([-score for score in scores], map(tuple, seqs[runs].tolist())))
+
+        heapq.heapify(self.heap)
+
+    def remove(self, key):
+        self._bridge(self._discard(key))
+
+    def pop(self):
+        """
+        take the best lobby out of the queue
+        returns a list of keys, or None if there's less than 2 people left
         """
 
-        n = len(players)
-        try:
-            mu_stdev = stdev([elo.mu for elo in elos if elo.player in players])
-        except ZeroDivisionError:
-            mu_stdev = 0
+        while self.heap:
+            _, group = heapq.heappop(self.heap)
+
+            # skip runs with players that left or got put in a lobby already
+            if not self._is_run(group):
+                continue
+
+            keys = [self.entries[seq][0] for seq in group]
+
+            position = self._position(group[0])
+            for key in keys:
+                self._discard(key)
+            self._bridge(position)
+
+            return keys
+
+        return None
+
+    def drain(self):
+        lobbies = []
+        while (lobby := self.pop()) is not None:
+            lobbies.append(lobby)
+        return lobbies
+
+
+def build_lobbies(ratings, min_size=MIN_LOBBY_SIZE, max_size=MAX_LOBBY_SIZE):
+    """
+    split queued players into lobbies
+
+    `ratings` is a list of (key, mu, sigma) tuples, one per player.
+    returns a list of lobbies (lists of keys), best lobby first.
 
-        try:
-            sigma_stdev = stdev([elo.sigma for elo in elos if elo.player in players])
-        except ZeroDivisionError:
-            sigma_stdev = 0
+    the old version scored every combination of 2-8 players, which blows up
+    really fast. see `LobbyQueue` for how it's done now.
+    """
 
-        # normalize stdevs with starting values
-        mu_stdev = mu_stdev / MODEL.mu
-        sigma_stdev = sigma_stdev / MODEL.sigma
+    queue = LobbyQueue(min_size, max_size)
+    queue.extend(ratings)
+    return queue.drain()
 
-        # i have no idea if this is gonna work well so we'll see
-        score = n**2 / (mu_stdev + (sigma_stdev / 5) + 1)
 
-        return score
+class Matchmaker:
+    def __init__(self, state=None):
+        # shared between workers, see queue_state.py
+        self.state = state or get_queue_state()
+        self.stats = {}
+
+        # category -> LobbyQueue of player pks, only for this process.
+        # it's kept up to date by add_player/remove_player and every
+        # matchmaking pass syncs it with the database, so only what changed
+        # since the last pass gets scored
+        self.queues = {}
+        # the web process has one Matchmaker for all its threads
+        self._lock = Lock()
 
     def add_player(self, player):
         players = Player.objects.filter(in_queue=True)
-        if (
-            not players.filter(discord_id=player.discord_id).exists()
-            and players.count() >= 2
-        ):
-            # self.counter += int(25 * (0.75 ** (len(players) - 2)))
-            self.counter += 1
+        if players.filter(discord_id=player.discord_id).exists():
+            return
 
-    def matchmake(self):
-        # initialize a queryset for matches
-        matches = Match.objects.none()
+        Player.objects.filter(pk=player.pk).update(
+            queue_joined_timestamp=timezone.now()
+        )
+
+        if players.count() >= 2:
+            # self.state.add_delay(amount=int(25 * (0.75 ** (len(players) - 2))))
+            self.state.add_delay()
+
+        # run_matchmaker has its own queues, these would never be matched or emptied
+        if settings.MATCHMAKING_BACKGROUND:
+            return
+
+        # score the lobbies around the player's rating right away
+        elos = {elo.category_id: elo for elo in Elo.objects.filter(player=player)}
+        categories = list(player.queues_for.all())
+
+        with self._lock:
+            for category in categories:
+                elo = elos.get(category.pk)
+                queue = self.queues.setdefault(category, LobbyQueue())
+                if elo:
+                    queue.add(player.pk, elo.mu, elo.sigma)
+                else:
+                    queue.add(player.pk, MODEL.mu, MODEL.sigma)
+
+    def remove_player(self, player):
+        with self._lock:
+            for queue in self.queues.values():
+                if player.pk in queue:
+                    queue.remove(player.pk)
+
+    def sync_queue(self, category, ratings):
+        """
+        bring the category's LobbyQueue in line with `ratings` from `load_queue`,
+        only adding and removing the players that changed
+        """
+
+        queue = self.queues.setdefault(category, LobbyQueue())
+        current = {player.pk: (mu, sigma) for player, mu, sigma in ratings}
+
+        added = 0
+        for pk in queue.keys():
+            if pk not in current:
+                queue.remove(pk)
 
+        if not queue:
+            queue.extend([(pk, mu, sigma) for pk, (mu, sigma) in current.items()])
+            added = len(current)
+        else:
+            for pk, rating in current.items():
+                if pk not in queue or queue.rating(pk) != rating:
+                    queue.add(pk, *rating)
+                    added += 1
+
+        self.stats["players_scored"] = self.stats.get("players_scored", 0) + added
+        return queue
+
+    def load_queue(self):
+        """
+        load everyone who's queuing along with their elos, in 3 queries
+        no matter how many players or categories there are
+
+        returns a dict of category -> list of (player, mu, sigma)
+        """
+
+        players = Player.objects.filter(in_queue=True).prefetch_related("queues_for")
+
+        elos = {
+            (elo.player_id, elo.category_id): elo
+            for elo in Elo.objects.filter(player__in_queue=True)
+        }
+
+        queue = {}
+        for player in players:
+            for category in player.queues_for.all():
+                # players without an elo yet get the starting one
+                elo = elos.get((player.pk, category.pk))
+                if elo:
+                    rating = (player, elo.mu, elo.sigma)
+                else:
+                    rating = (player, MODEL.mu, MODEL.sigma)
+
+                queue.setdefault(category, []).append(rating)
+
+        return queue
+
+    def matchmake(self):
         players = Player.objects.filter(in_queue=True)
 
         # if not ready to matchmake yet
         if players.count() < 2:
-            return matches
+            return Match.objects.none()
+
+        # the global bucket is only the delay after players join, it's released
+        # before making matches. every category locks its own bucket for that
+        with self.state.matchmaking_pass() as ready:
+            if not ready:
+                print("delay: ", self.state.get_delay())
+                return Match.objects.none()
 
-        if self.counter > 0:
-            self.counter -= 1
-            print("counter: ", self.counter)
-            return matches
+        return self.make_matches()
 
-        # for now we are going to assume that all matches are 1v1
+    def make_matches(self):
+        with QueryCounter() as snapshot_queries:
+            queue = self.load_queue()
+
+        self.stats["snapshot_queries"] = snapshot_queries.count
+
+        with self._lock:
+            return self.make_matches_from(queue)
+
+    def make_matches_from(self, queue):
+        # nobody's queuing for these anymore
+        for category in set(self.queues) - set(queue):
+            del self.queues[category]
 
         # randomize the order of all categories and then check them all
-        categories = Category.objects.all().order_by("?")
+        categories = list(queue)
+        random.shuffle(categories)
+
+        self.stats["players_scored"] = 0
+
+        match_ids = []
+        matched = set()
         for category in categories:
-            category_players = list(players.filter(queues_for=category).order_by("?"))
+            # someone queuing for more than one category might already be in a match
+            ratings = [rating for rating in queue[category] if rating[0] not in matched]
 
-            if len(category_players) < 2:
+            try:
+                made = self.matchmake_category(category, ratings)
+            except Exception:
+                # its matches were rolled back, the other categories still get theirs.
+                # its LobbyQueue might be half popped, so it's rebuilt next pass
+                logger.exception("matchmaking %s failed", category)
+                self.queues.pop(category, None)
                 continue
 
-            elos = set()
-            for player in category_players:
-                elo = Elo.objects.filter(player=player, category=category).first()
-                if elo:
-                    elos.add(elo)
+            for match, lobby in made:
+                match_ids.append(match.match_id)
+                matched.update(lobby)
 
-            possible_matches = set()
-            for r in range(2, min(len(category_players), 8) + 1):  # min 2, max 8
-                possible_matches.update(
-                    comb for comb in combinations(category_players, r)
-                )
+        # return queryset
+        return Match.objects.filter(match_id__in=match_ids)
+
+    def matchmake_category(self, category, ratings):
+        """
+        make matches for one category out of `ratings`, a list of
+        (player, mu, sigma) from `load_queue`
 
-            match_to_score = {
-                matchup: self.score(matchup, elos, category)
-                for matchup in possible_matches
-            }
+        returns a (match, players) pair for every match created
+        """
 
-            del possible_matches  # save memory
+        lobby_queue = self.sync_queue(category, ratings)
 
-            while len(players) > 1 and match_to_score:
-                # get the match with the highest score
-                best_match = max(match_to_score, key=match_to_score.get)
+        if len(lobby_queue) < 2:
+            return []
 
-                print("best match players: ", best_match)
-                print("best match score: ", match_to_score[best_match])
+        matches = []
+        with self.state.matchmaking_pass(category_bucket(category)) as ready:
+            if not ready:
+                return matches
 
-                match_to_score.pop(best_match)
+            # every category in its own transaction (InMemoryQueueState doesn't open one),
+            # so a failure only rolls back this category's matches
+            with transaction.atomic():
+                # lock everyone that's still queuing, so another worker matchmaking
+                # a different category can't put them in a match at the same time
+                queued = set(
+                    Player.objects.select_for_update()
+                    .filter(
+                        pk__in=[rating[0].pk for rating in ratings], in_queue=True
+                    )
+                    .values_list("pk", flat=True)
+                )
+                for pk in lobby_queue.keys():
+                    if pk not in queued:
+                        lobby_queue.remove(pk)
 
-                # create the match
-                teams = [[player] for player in best_match]
-                match = create_match(teams, category)
-                matches |= Match.objects.filter(match_id=match.match_id)
+                players = {rating[0].pk: rating[0] for rating in ratings}
 
-                # remove players from the pool
-                for player in best_match:
-                    category_players.remove(player)
+                while (lobby := lobby_queue.pop()) is not None:
+                    lobby = [players[pk] for pk in lobby]
+                    print("best match players: ", lobby)
 
-                # remove matches that contain the players in the match
-                for match in set(match_to_score.keys()):
-                    if any(player in match for player in best_match):
-                        match_to_score.pop(match)
+                    # create the match
+                    teams = [[player] for player in lobby]
+                    match = create_match(teams, category)
+                    matches.append((match, lobby))
 
-        # return queryset
         return matches
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0002_alter_player_currently_playing_match_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueState',
+            fields=[
+                ('bucket', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('counter', models.IntegerField(default=0)),
+                ('last_matchmake_timestamp', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='queue_joined_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0003_queue_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='elo',
+            name='rank',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='elo',
+            index=models.Index(fields=['category', 'rank'], name='wgl_api_elo_categor_d4f541_idx'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_elo AS elo
+            SET rank = ranked.rank
+            FROM (
+                SELECT id, RANK() OVER (PARTITION BY category_id ORDER BY mu DESC) AS rank
+                FROM wgl_api_elo
+            ) AS ranked
+            WHERE elo.id = ranked.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
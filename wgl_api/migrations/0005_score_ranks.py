@@ -0,0 +1,68 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0004_elo_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teamplayer',
+            name='non_obsolete_rank',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='teamplayer',
+            name='overall_rank',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='teamplayer',
+            name='player_rank',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='teamplayer',
+            index=models.Index(fields=['category', 'overall_rank'], name='wgl_api_tea_categor_0c3994_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teamplayer',
+            index=models.Index(condition=models.Q(('non_obsolete_rank__isnull', False)), fields=['category', 'non_obsolete_rank'], name='teamplayer_non_obsolete_idx'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_teamplayer AS tp
+            SET overall_rank = ranked.overall_rank,
+                player_rank = ranked.player_rank,
+                non_obsolete_rank = ranked.non_obsolete_rank
+            FROM (
+                SELECT
+                    tp.id,
+                    RANK() OVER (
+                        PARTITION BY tp.category_id ORDER BY tp.score ASC
+                    ) AS overall_rank,
+                    RANK() OVER (
+                        PARTITION BY tp.category_id, tp.player_id ORDER BY tp.score ASC
+                    ) AS player_rank,
+                    CASE
+                        WHEN ROW_NUMBER() OVER (
+                            PARTITION BY tp.category_id, tp.player_id
+                            ORDER BY tp.score ASC, match.timestamp_started ASC
+                        ) = 1
+                        THEN RANK() OVER (
+                            PARTITION BY tp.category_id ORDER BY tp.score ASC
+                        )
+                    END AS non_obsolete_rank
+                FROM wgl_api_teamplayer AS tp
+                INNER JOIN wgl_api_match AS match ON match.match_id = tp.match_id
+                WHERE match.status = 'Finished'
+            ) AS ranked
+            WHERE tp.id = ranked.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0005_score_ranks'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='elo',
+            name='wgl_api_elo_categor_d4f541_idx',
+        ),
+        migrations.AddIndex(
+            model_name='elo',
+            index=models.Index(fields=['category', 'rank', 'id'], name='wgl_api_elo_categor_c34059_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['-timestamp_started', '-match_id'], name='wgl_api_mat_timesta_a5bd88_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['category', '-timestamp_started', '-match_id'], name='wgl_api_mat_categor_dd86b9_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='leaderboard_revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='updated_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0007_revisions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='currently_playing_match',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wgl_api.match'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(condition=models.Q(('currently_playing_match__isnull', False)), fields=['currently_playing_match'], name='player_playing_idx'),
+        ),
+        # it isn't computed anymore, so make sure it starts out right
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_player AS player
+            SET currently_playing_match_id = playing.match_id
+            FROM (
+                SELECT DISTINCT ON (tp.player_id) tp.player_id, tp.match_id
+                FROM wgl_api_teamplayer AS tp
+                INNER JOIN wgl_api_team AS team ON team.id = tp.team_id
+                INNER JOIN wgl_api_match AS match ON match.match_id = tp.match_id
+                WHERE match.active AND NOT team.forfeited AND tp.player_id IS NOT NULL
+                ORDER BY tp.player_id, match.timestamp_started DESC
+            ) AS playing
+            WHERE player.discord_id = playing.player_id
+            AND player.currently_playing_match_id IS DISTINCT FROM playing.match_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_player AS player
+            SET currently_playing_match_id = NULL
+            WHERE currently_playing_match_id IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1
+                FROM wgl_api_teamplayer AS tp
+                INNER JOIN wgl_api_team AS team ON team.id = tp.team_id
+                INNER JOIN wgl_api_match AS match ON match.match_id = tp.match_id
+                WHERE tp.player_id = player.discord_id
+                AND tp.match_id = player.currently_playing_match_id
+                AND match.active AND NOT team.forfeited
+            )
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0008_currently_playing_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='team',
+            name='score',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0009_team_score_sql'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='elo',
+            index=models.Index(fields=['category', '-mu'], name='elo_category_mu_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('active', True)), fields=['-timestamp_started', '-match_id'], name='match_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(condition=models.Q(('in_queue', True)), fields=['queue_joined_timestamp', 'discord_id'], name='player_in_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teamplayer',
+            index=models.Index(fields=['category', 'score'], name='teamplayer_category_score_idx'),
+        ),
+        # any duplicate elos come from two matches creating the same new player's
+        # elo at once, and have been updated together since. keep the oldest one
+        migrations.RunSQL(
+            """
+            DELETE FROM wgl_api_elo AS elo
+            USING wgl_api_elo AS older
+            WHERE older.player_id = elo.player_id
+            AND older.category_id = elo.category_id
+            AND older.id < elo.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_elo AS elo
+            SET rank = ranked.rank
+            FROM (
+                SELECT id, RANK() OVER (PARTITION BY category_id ORDER BY mu DESC) AS rank
+                FROM wgl_api_elo
+            ) AS ranked
+            WHERE elo.id = ranked.id
+            AND elo.rank IS DISTINCT FROM ranked.rank
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='elo',
+            constraint=models.UniqueConstraint(fields=('player', 'category'), name='elo_player_category_unique'),
+        ),
+    ]
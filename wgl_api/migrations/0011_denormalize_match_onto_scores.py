@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='teamplayer',
+            name='teamplayer_category_score_idx',
+        ),
+        migrations.AddField(
+            model_name='teamplayer',
+            name='match_finished',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='teamplayer',
+            name='match_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE wgl_api_teamplayer AS tp
+            SET match_finished = match.status = 'Finished',
+                match_started = match.timestamp_started
+            FROM wgl_api_match AS match
+            WHERE match.match_id = tp.match_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='teamplayer',
+            index=models.Index(fields=['category', 'match_finished', 'score', 'match_started'], name='teamplayer_scores_idx'),
+        ),
+    ]
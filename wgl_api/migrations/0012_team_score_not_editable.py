@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wgl_api', '0011_denormalize_match_onto_scores'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='team',
+            name='score',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+    ]
@@ -1,15 +1,15 @@
 from django.db import models
+from django.utils import timezone
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 
-from django_cte import CTEManager
-
 from computedfields.models import ComputedFieldsModel, computed, precomputed
 
-from ranking import Ranking, COMPETITION
-
+from .cache import CATEGORIES, invalidate, leaderboard_scope, scores_scope
 from .utils import format_score, ms_to_time, num_to_delta
 from .elo import calculate_elo
+from .computed import run_batched
+from .rankings import refresh_elo_ranks, refresh_score_ranks, refresh_team_scores
 
 # Create your models here.
 
@@ -37,7 +37,7 @@ class Youtube(models.Model):
         super().clean()
 
 
-class Player(ComputedFieldsModel):
+class Player(models.Model):
     discord_id = models.BigIntegerField(primary_key=True, null=False, unique=True)
     username = models.CharField(max_length=64, null=False, unique=True)
     youtube = models.OneToOneField(
@@ -53,31 +53,38 @@ class Player(ComputedFieldsModel):
     queues_for = models.ManyToManyField(
         "Category", related_name="players_in_queue", blank=True
     )
-
-    @computed(
-        models.ForeignKey(
-            "Match",
-            on_delete=models.SET_NULL,
-            null=True,
-            blank=True,
-        ),
-        depends=[("teamplayer.match", ["active"]), ("teamplayer.team", ["forfeited"])],
+    queue_joined_timestamp = models.DateTimeField(null=True, blank=True)
+
+    # the active match the player is in (and hasn't forfeited).
+    # set by create_match, and kept up to date by Match.update_currently_playing
+    currently_playing_match = models.ForeignKey(
+        "Match",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
     )
-    def currently_playing_match(self):
-        match = Match.objects.filter(
-            teams__teamplayer__player=self,
-            teams__forfeited=False,
-            active=True,
-        ).first()
-        if match:
-            return match.match_id
-        else:
-            return None
 
     accept_challenges = models.BooleanField(null=False, default=True)
 
     banned = models.BooleanField(null=False, default=False)
 
+    class Meta:
+        indexes = [
+            # only a handful of players are ever in a match at once
+            models.Index(
+                fields=["currently_playing_match"],
+                condition=models.Q(currently_playing_match__isnull=False),
+                name="player_playing_idx",
+            ),
+            # or in the queue. matchmaking and the queue list, in join order
+            models.Index(
+                fields=["queue_joined_timestamp", "discord_id"],
+                condition=models.Q(in_queue=True),
+                name="player_in_queue_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.username}"
 
@@ -90,14 +97,25 @@ class Category(models.Model):
     speedrun = models.BooleanField(null=False, default=True)
     require_all_livestreams = models.BooleanField(null=False, default=True)
 
+    # goes up whenever an elo in the category changes, see rankings.py.
+    # the leaderboard's etag
+    leaderboard_revision = models.PositiveIntegerField(null=False, default=0)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        # the category is in the cached category list and in every score
+        invalidate(CATEGORIES, scores_scope(self.pk))
+
+    def delete(self, *args, **kwargs):
+        invalidate(CATEGORIES, scores_scope(self.pk), leaderboard_scope(self.pk))
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.category_name}"
 
 
 class TeamPlayer(ComputedFieldsModel):
-    # needed for ranking scores
-    objects = CTEManager()
-
     player = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True)
     match = models.ForeignKey("Match", on_delete=models.CASCADE)
 
@@ -138,6 +156,59 @@ class TeamPlayer(ComputedFieldsModel):
     sigma_before = models.FloatField(null=False, default=1)
     sigma_after = models.FloatField(null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_score = dict(zip(field_names, values)).get("score")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Match.touch(self.match_id)
+
+        # the team's score changed
+        run_batched(refresh_team_scores, self.match_id, False)
+
+        # a score on the board changed (eg. a finished match's result was corrected),
+        # only the scores between the old and new one move
+        old_score = getattr(self, "_loaded_score", None)
+        if self.match_finished and self.pk and old_score != self.score:
+            scores = [score for score in (old_score, self.score) if score is not None]
+            run_batched(
+                refresh_score_ranks,
+                self.category_id,
+                min(scores),
+                # to or from no score at all moves everything above
+                max(scores) if len(scores) == 2 else None,
+            )
+        self._loaded_score = self.score
+
+    # copied from the match so the score queries don't need to join it.
+    # set by create_match, match_finished is kept up to date by Match.save
+    match_finished = models.BooleanField(null=False, default=False)
+    match_started = models.DateTimeField(null=True, blank=True)
+
+    # score leaderboard ranks, only set once the match is finished.
+    # kept up to date by rankings.py
+    overall_rank = models.IntegerField(null=True, blank=True)
+    player_rank = models.IntegerField(null=True, blank=True)
+    non_obsolete_rank = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["category", "overall_rank"]),
+            models.Index(
+                fields=["category", "non_obsolete_rank"],
+                condition=models.Q(non_obsolete_rank__isnull=False),
+                name="teamplayer_non_obsolete_idx",
+            ),
+            # working out the score ranks, see rankings.refresh_score_ranks
+            models.Index(
+                fields=["category", "match_finished", "score", "match_started"],
+                name="teamplayer_scores_idx",
+            ),
+        ]
+
 
 class Team(ComputedFieldsModel):
     match = models.ForeignKey("Match", on_delete=models.CASCADE)
@@ -155,24 +226,9 @@ class Team(ComputedFieldsModel):
 
     place = models.SmallIntegerField(null=True)
 
-    @computed(
-        models.IntegerField(null=True),
-        depends=[
-            ("teamplayer_set", ["score"])
-        ],  # depends on everyone on the team's scores
-    )
-    def score(self):
-        # you can't access the many-to-many relationship below if the team has no pk yet (ie. newly created)
-        if not self.pk:
-            return None
-
-        score = 0
-        for player in self.players.all():
-            if player.score is None:
-                return None
-            score += player.score
-
-        return score
+    # the sum of everyone on the team's scores.
+    # kept up to date along with place by rankings.refresh_team_scores, so it's not editable
+    score = models.IntegerField(null=True, editable=False)
 
     @computed(
         models.CharField(max_length=12, null=True),
@@ -186,6 +242,12 @@ class Team(ComputedFieldsModel):
 
     forfeited = models.BooleanField(null=False, default=False)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_forfeited = dict(zip(field_names, values)).get("forfeited")
+        return instance
+
     @precomputed
     def save(self, *args, **kwargs):
         # TODO: i only need this because of the match places not working
@@ -194,7 +256,19 @@ class Team(ComputedFieldsModel):
 
         # if self.pk:
         #     self.match.save()
+
+        # a new team has no players yet, so it can't change who's playing
+        forfeit_changed = not self._state.adding and self.forfeited != getattr(
+            self, "_loaded_forfeited", None
+        )
+
         super().save(*args, **kwargs)
+        Match.touch(self.match_id)
+
+        # the team just forfeited (or stopped forfeiting)
+        if forfeit_changed:
+            Match.update_currently_playing(self.match_id)
+        self._loaded_forfeited = self.forfeited
 
 
 class Match(ComputedFieldsModel):
@@ -206,6 +280,9 @@ class Match(ComputedFieldsModel):
     timestamp_started = models.DateTimeField(auto_now_add=True)
     timestamp_finished = models.DateTimeField(null=True, blank=True)
 
+    # when anything in the match (or its teams and players) last changed. the match's etag
+    updated_timestamp = models.DateTimeField(auto_now=True)
+
     num_teams = models.SmallIntegerField(null=False, default=2)
     players_per_team = models.SmallIntegerField(null=False, default=1)
     teams = models.ManyToManyField(Team, related_name="match_teams")
@@ -230,40 +307,104 @@ class Match(ComputedFieldsModel):
         ],
     )
 
-    def save(self, *args, **kwargs):
-        # TODO: this is so bad. i shouldnt do this on every match save
+    class Meta:
+        indexes = [
+            # match history pages, see MatchPagination
+            models.Index(fields=["-timestamp_started", "-match_id"]),
+            models.Index(fields=["category", "-timestamp_started", "-match_id"]),
+            # active matches are a small slice of the history
+            models.Index(
+                fields=["-timestamp_started", "-match_id"],
+                condition=models.Q(active=True),
+                name="match_active_idx",
+            ),
+        ]
 
-        if self.pk:
-            # places for teams
+    def update_placements(self):
+        """
+        work out every team's score and place from the team players' scores
+        and the forfeits, in one query (see rankings.refresh_team_scores)
 
-            teams = self.teams.filter(forfeited=False).order_by("score")
+        returns the teams and whether any place changed
+        """
 
-            scores = sorted(
-                [team.score for team in teams], key=lambda x: (x is None, x)
-            )  # ascending order, push None's to end
+        teams = refresh_team_scores(self.pk)
+        return teams, any(team.place_changed for team in teams)
 
-            ranking = Ranking(scores, strategy=COMPETITION, start=1, reverse=True)
-            ranks = ranking.ranks()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
-            for team, rank in zip(teams, ranks):
-                Team.objects.filter(pk=team.pk).update(place=rank)
+    def get_dirty_fields(self):
+        """
+        names of the fields that changed since the match was loaded,
+        or None if we don't know (ie. it wasn't loaded from the database)
+        """
 
-            forfeited = self.teams.filter(forfeited=True)
-            if forfeited:
-                place = self.teams.count() - forfeited.count() + 1  # tied for last
-                for team in forfeited:
-                    Team.objects.filter(pk=team.pk).update(place=place)
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return None
 
-            # if there is one team remaining that hasn't forfeited, set it as 1st place
-            if teams.count() == 1:
-                Team.objects.filter(pk=teams.first().pk).update(place=1)
+        return {
+            field.name
+            for field in self._meta.concrete_fields
+            if field.attname in loaded
+            and getattr(self, field.attname) != loaded[field.attname]
+        }
+
+    @classmethod
+    def touch(cls, *match_ids):
+        """
+        mark matches as changed, for when their teams or players were saved
+        """
+
+        cls.objects.filter(match_id__in=match_ids).update(
+            updated_timestamp=timezone.now()
+        )
+
+    @classmethod
+    def update_currently_playing(cls, match_id):
+        """
+        point the players of a match at it while it's active and their team
+        hasn't forfeited, and away from it otherwise
+        """
+
+        playing = Player.objects.filter(
+            teamplayer__match_id=match_id,
+            teamplayer__match__active=True,
+            teamplayer__team__forfeited=False,
+        )
+
+        Player.objects.filter(currently_playing_match_id=match_id).exclude(
+            pk__in=playing.values("pk")
+        ).update(currently_playing_match=None)
+
+        # players who are already in another match stay in that one
+        Player.objects.filter(
+            pk__in=playing.values("pk"), currently_playing_match__isnull=True
+        ).update(currently_playing_match=match_id)
+
+    def save(self, *args, **kwargs):
+        places_changed = False
+
+        if self.pk:
+            # places for teams.
+            # this only writes anything if a score or forfeit moved a team,
+            # so saves that don't touch the result just cost the one query
+            teams, places_changed = self.update_placements()
+
+            playing = [team for team in teams if not team.forfeited]
 
             # calculate elos if everyone has a place
-            if self.active and all(team.place is not None for team in teams):
+            if self.active and all(team.place is not None for team in playing):
                 if self.status == "Ongoing":
                     self.status = "Waiting for agrees"
 
-                calculate_elo(self)
+                # the previews only depend on the places
+                if places_changed:
+                    calculate_elo(self, teams)
 
         # def save(
         #     self, *args, **kwargs
@@ -290,8 +431,45 @@ class Match(ComputedFieldsModel):
         # self.p1.save()
         # self.p2.save()
 
+        # only write the fields that changed, so computedfields doesn't
+        # go through every dependent of the match for something like discord_thread_id
+        dirty = self.get_dirty_fields()
+        if self.pk and kwargs.get("update_fields") is None and dirty is not None:
+            if not dirty and not places_changed:
+                return
+            kwargs["update_fields"] = dirty | {"updated_timestamp"}
+
+        loaded = getattr(self, "_loaded_values", {})
+        old_status = loaded.get("status")
+
         super().save(*args, **kwargs)
 
+        # the match just started or stopped being active
+        if self.pk and "active" in loaded and loaded["active"] != self.active:
+            Match.update_currently_playing(self.pk)
+
+        # scores of finished matches are on the score leaderboard
+        if self.pk and "Finished" in (old_status, self.status) and old_status != self.status:
+            tps = TeamPlayer.objects.filter(match=self)
+            if self.status == "Finished":
+                tps.update(match_finished=True)
+            else:
+                tps.update(
+                    match_finished=False,
+                    overall_rank=None,
+                    player_rank=None,
+                    non_obsolete_rank=None,
+                )
+
+            # the match's scores came onto (or left) the board, everything above moves
+            lowest = tps.aggregate(lowest=models.Min("score"))["lowest"]
+            refresh_score_ranks(self.category_id, lowest)
+
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
     # p1 = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="p1")
 
     # @computed(
@@ -540,6 +718,30 @@ class Elo(models.Model):
     mu = models.SmallIntegerField(null=False, default=STARTING_ELO)
     sigma = models.FloatField(null=False, default=STARTING_ELO / 3)
 
+    # position on the category's leaderboard, kept up to date by rankings.py
+    rank = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # leaderboard pages, see LeaderboardPagination
+            models.Index(fields=["category", "rank", "id"]),
+            # the mu ranges in rankings.refresh_elo_ranks
+            models.Index(fields=["category", "-mu"], name="elo_category_mu_idx"),
+        ]
+        constraints = [
+            # one elo per player per category, also the index for looking it up
+            models.UniqueConstraint(
+                fields=["player", "category"], name="elo_player_category_unique"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        # single saves only really happen from the admin panel,
+        # so just redo the whole category
+        refresh_elo_ranks(self.category_id)
+
     def __str__(self):
         return f"{self.player}:{self.category}:{'{:.1f}'.format(self.mu)} elo"
 
@@ -561,3 +763,16 @@ class Challenge(models.Model):
 
     def __str__(self):
         return f"{self.challenge_id}: {self.challenger} challenged {self.challenged} to {self.category}"
+
+
+class QueueState(models.Model):
+    # "global" or "category:<category_id>", see queue_state.py
+    bucket = models.CharField(max_length=32, primary_key=True)
+
+    # how many more matchmaking passes to skip before making matches
+    counter = models.IntegerField(null=False, default=0)
+
+    last_matchmake_timestamp = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.bucket}: {self.counter}"
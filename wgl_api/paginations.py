@@ -1,6 +1,191 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
 
 class RankingPagination(PageNumberPagination):
     page_size = 50
-    
-    
\ No newline at end of file
+
+
+class KeysetPagination(BasePagination):
+    """
+    keyset pagination, so deep pages don't need an OFFSET scan or a COUNT.
+    the cursor is the last row's values for every column of `ordering`, and the next
+    page is the rows after it: WHERE (rank, id) > (<rank>, <id>).
+    the old page number format is still there with ?page=<n>
+
+    subclasses set `ordering`, which needs a matching index. its columns can't be null,
+    all go the same direction, and the last one has to be unique
+    """
+
+    page_size = 50
+    cursor_query_param = "cursor"
+    ordering = ()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_number_pagination = None
+
+        if request.query_params.get(RankingPagination.page_query_param) is not None:
+            self.page_number_pagination = RankingPagination()
+            return self.page_number_pagination.paginate_queryset(
+                queryset.order_by(*self.ordering), request, view
+            )
+
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # the async views don't do ?page=<n>, they hand those to the sync views
+        self.page_number_pagination = None
+
+        queryset = self.page_queryset(queryset, request)
+        return self.set_page([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.position, self.reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = _reverse_ordering(ordering)
+
+        queryset = queryset.order_by(*ordering)
+
+        if self.position is not None:
+            columns = ", ".join(self.column(field) for field in ordering)
+            placeholders = ", ".join(["%s"] * len(ordering))
+            operator = "<" if ordering[0].startswith("-") else ">"
+
+            # one row comparison, so postgres starts the index scan right after the cursor
+            queryset = queryset.extra(
+                where=[f"({columns}) {operator} ({placeholders})"],
+                params=self.position,
+            )
+
+        # one extra row to know if there's another page
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        more = len(results) > self.page_size
+        self.page = list(results[: self.page_size])
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_previous = more
+            self.has_next = True
+        else:
+            self.has_previous = self.position is not None
+            self.has_next = more
+
+        return self.page
+
+    def field(self, name):
+        name = name.lstrip("-")
+        if name == "pk":
+            return self.model._meta.pk
+
+        return self.model._meta.get_field(name)
+
+    def column(self, name):
+        quote = connection.ops.quote_name
+        return f"{quote(self.model._meta.db_table)}.{quote(self.field(name).column)}"
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+
+        try:
+            reverse, position = json.loads(urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+
+            position = [
+                self.field(name).to_python(value)
+                for name, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound("Invalid cursor")
+
+        return position, bool(reverse)
+
+    def encode_cursor(self, row, reverse):
+        position = [row[name.lstrip("-")] for name in self.ordering]
+        cursor = json.dumps([reverse, position], cls=DjangoJSONEncoder)
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            urlsafe_b64encode(cursor.encode()).decode(),
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        if not self.page:
+            # came back past the start, the first page starts from nothing
+            return remove_query_param(self.base_url, self.cursor_query_param)
+
+        return self.encode_cursor(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            return None
+
+        return self.encode_cursor(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        if self.page_number_pagination is not None:
+            return self.page_number_pagination.get_paginated_response(data)
+
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+
+class LeaderboardPagination(KeysetPagination):
+    ordering = ("rank", "pk")
+
+
+class ScoresPagination(KeysetPagination):
+    ordering = ("overall_rank", "match_started", "pk")
+
+
+class MatchPagination(KeysetPagination):
+    """
+    /match has always been a plain list of every match, so that's still the default.
+    ?cursor= (empty for the first page) or ?page=<n> page through it instead
+    """
+
+    ordering = ("-timestamp_started", "-match_id")
+
+    @classmethod
+    def wanted(cls, request):
+        return (
+            cls.cursor_query_param in request.query_params
+            or RankingPagination.page_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.wanted(request):
+            return None
+
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+GLOBAL_BUCKET = "global"
+
+
+def category_bucket(category):
+    return f"category:{category.pk}"
+
+
+class InMemoryQueueState:
+    """
+    queue state that only lives in this process
+
+    fine for tests and a single runserver, but every worker gets its own copy
+    so don't use it with more than one worker
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.last_matchmake = {}
+        self.locks = {}
+        self._lock = Lock()
+
+    def add_delay(self, bucket=GLOBAL_BUCKET, amount=1):
+        with self._lock:
+            self.counters[bucket] = self.counters.get(bucket, 0) + amount
+
+    def get_delay(self, bucket=GLOBAL_BUCKET):
+        return self.counters.get(bucket, 0)
+
+    @contextmanager
+    def matchmaking_pass(self, bucket=GLOBAL_BUCKET):
+        """
+        yields True if this caller should run a matchmaking pass for `bucket`
+
+        yields False if another pass is already running, or if the bucket is
+        still being delayed (in which case the delay goes down by 1)
+        """
+
+        with self._lock:
+            lock = self.locks.setdefault(bucket, Lock())
+
+        if not lock.acquire(blocking=False):
+            yield False
+            return
+
+        try:
+            with self._lock:
+                counter = self.counters.get(bucket, 0)
+                if counter > 0:
+                    self.counters[bucket] = counter - 1
+
+            if counter > 0:
+                yield False
+            else:
+                self.last_matchmake[bucket] = timezone.now()
+                yield True
+        finally:
+            lock.release()
+
+
+class DatabaseQueueState:
+    """
+    queue state stored in the `QueueState` table so every worker shares it
+
+    a matchmaking pass holds a row lock on its bucket for the whole pass,
+    so two workers can never run the same pass at once
+    """
+
+    def _row(self, bucket):
+        from .models import QueueState
+
+        QueueState.objects.get_or_create(bucket=bucket)
+        return QueueState.objects.filter(bucket=bucket)
+
+    def add_delay(self, bucket=GLOBAL_BUCKET, amount=1):
+        self._row(bucket).update(counter=F("counter") + amount)
+
+    def get_delay(self, bucket=GLOBAL_BUCKET):
+        return self._row(bucket).values_list("counter", flat=True).first()
+
+    @contextmanager
+    def matchmaking_pass(self, bucket=GLOBAL_BUCKET):
+        """
+        yields True if this caller should run a matchmaking pass for `bucket`
+
+        yields False if another worker is already running one, or if the
+        bucket is still being delayed (in which case the delay goes down by 1)
+        """
+
+        row = self._row(bucket)
+
+        with transaction.atomic():
+            # skip_locked so a busy worker doesn't make the others wait on it
+            state = row.select_for_update(skip_locked=True).first()
+
+            if state is None:
+                yield False
+                return
+
+            if state.counter > 0:
+                row.update(counter=F("counter") - 1)
+                yield False
+                return
+
+            row.update(last_matchmake_timestamp=timezone.now())
+            yield True
+
+
+def get_queue_state():
+    return import_string(settings.MATCHMAKING_QUEUE_STATE)()
@@ -0,0 +1,238 @@
+# precomputed ranks (and team scores/places), so reads don't need a window function or an aggregate
+from django.db import connection, transaction
+from django.db.models import F
+
+from .cache import invalidate, leaderboard_scope, scores_scope
+from . import events
+
+
+def refresh_elo_ranks(category_id, lowest_mu=None, highest_mu=None):
+    """
+    update `Elo.rank` for a category after some elos changed
+
+    a player's rank only depends on how many players have a higher mu,
+    so if every changed elo went from/to a mu between `lowest_mu` and
+    `highest_mu`, only the players in that range can move.
+    leave either one as None if the range is open on that side.
+
+    only rows whose rank actually changed get written
+    """
+
+    from .models import Category, Elo
+
+    table = Elo._meta.db_table
+
+    inner_filter = ""
+    outer_filter = ""
+    params = [category_id]
+
+    if lowest_mu is not None:
+        inner_filter = "AND mu >= %s"
+        params.append(lowest_mu)
+
+    if highest_mu is not None:
+        outer_filter = "AND elo.mu <= %s"
+
+    query = f"""
+        UPDATE {table} AS elo
+        SET rank = ranked.rank
+        FROM (
+            SELECT id, RANK() OVER (ORDER BY mu DESC) AS rank
+            FROM {table}
+            WHERE category_id = %s {inner_filter}
+        ) AS ranked
+        WHERE elo.id = ranked.id
+        AND elo.rank IS DISTINCT FROM ranked.rank
+        {outer_filter}
+    """
+
+    if highest_mu is not None:
+        params.append(highest_mu)
+
+    # (no savepoint, the callers are already in a transaction)
+    with transaction.atomic(savepoint=False):
+        # every caller changed some elos, so the cached leaderboard is out of date.
+        # this goes first since it locks the category's row until commit: refreshes
+        # in the same category take turns, and each one ranks the mus the other committed
+        Category.objects.filter(category_id=category_id).update(
+            leaderboard_revision=F("leaderboard_revision") + 1
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+
+    invalidate(leaderboard_scope(category_id))
+    events.publish(events.LEADERBOARD_CHANGED, category_id=category_id)
+
+
+def refresh_score_ranks(category_id, lowest_score=None, highest_score=None):
+    """
+    update the score ranks of a category's finished `TeamPlayer`s after a match
+    finished (or stopped being finished), or a finished score changed
+
+    - overall_rank: rank among every finished score in the category
+    - player_rank: rank among the player's own finished scores
+    - non_obsolete_rank: the overall rank, but only on each player's best score
+      (the earliest one if they got the same best score twice), else null
+
+    lower scores rank higher, so a score's ranks only depend on the scores below it.
+    if every score that was added, removed or changed went from/to a score between
+    `lowest_score` and `highest_score`, only the scores in that range can move
+    (leave `highest_score` as None when scores were added or removed, everything
+    above moves then). unfinished scores are cleared by Match.save.
+
+    only rows whose ranks actually changed get written
+    """
+
+    from .models import TeamPlayer
+
+    table = TeamPlayer._meta.db_table
+
+    inner_filter = ""
+    outer_filter = ""
+    params = [category_id]
+
+    if highest_score is not None:
+        inner_filter = "AND tp.score <= %s"
+        params.append(highest_score)
+
+    if lowest_score is not None:
+        # scores without a number rank last, below everything in the range
+        outer_filter = "AND (tp.score >= %s"
+        outer_filter += ")" if highest_score is not None else " OR tp.score IS NULL)"
+
+    # match_finished and match_started are copied from the match,
+    # so this all comes out of teamplayer_scores_idx without a join
+    query = f"""
+        UPDATE {table} AS tp
+        SET overall_rank = ranked.overall_rank,
+            player_rank = ranked.player_rank,
+            non_obsolete_rank = ranked.non_obsolete_rank
+        FROM (
+            SELECT
+                tp.id,
+                RANK() OVER (ORDER BY tp.score ASC) AS overall_rank,
+                RANK() OVER (
+                    PARTITION BY tp.player_id ORDER BY tp.score ASC
+                ) AS player_rank,
+                CASE
+                    WHEN ROW_NUMBER() OVER (
+                        PARTITION BY tp.player_id
+                        ORDER BY tp.score ASC, tp.match_started ASC
+                    ) = 1
+                    THEN RANK() OVER (ORDER BY tp.score ASC)
+                END AS non_obsolete_rank
+            FROM {table} AS tp
+            WHERE tp.category_id = %s AND tp.match_finished {inner_filter}
+        ) AS ranked
+        WHERE tp.id = ranked.id
+        {outer_filter}
+        AND (
+            tp.overall_rank IS DISTINCT FROM ranked.overall_rank
+            OR tp.player_rank IS DISTINCT FROM ranked.player_rank
+            OR tp.non_obsolete_rank IS DISTINCT FROM ranked.non_obsolete_rank
+        )
+    """
+
+    if lowest_score is not None:
+        params.append(lowest_score)
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+
+    # some finished scores changed, so the cached scores are out of date
+    invalidate(scores_scope(category_id))
+
+
+def refresh_team_scores(match_id, places=True):
+    """
+    update `Team.score` and `Team.place` for every team in a match, in one query.
+    with `places=False` only the scores are updated (places follow the match, see Match.save)
+
+    - score: the sum of the team players' scores, or null until they all have one
+    - place: rank by score (lowest first, ties share a place), null without a score.
+      forfeited teams are tied for last, and if only one team hasn't forfeited it's 1st
+
+    only rows whose score or place actually changed get written.
+    returns every team of the match with the new values, each with
+    `score_changed` and `place_changed` set
+    """
+
+    from .models import Category, Team, TeamPlayer
+    from .utils import format_score
+
+    table = Team._meta.db_table
+    tp_table = TeamPlayer._meta.db_table
+
+    query = f"""
+        WITH scored AS (
+            SELECT
+                team.id,
+                team.match_id,
+                team.forfeited,
+                team.place AS old_place,
+                CASE
+                    WHEN COUNT(tp.id) = COUNT(tp.score) THEN SUM(tp.score)
+                END AS score
+            FROM {table} AS team
+            LEFT JOIN {tp_table} AS tp ON tp.team_id = team.id
+            WHERE team.match_id = %(match_id)s
+            GROUP BY team.id
+        ),
+        placed AS (
+            SELECT
+                id,
+                score,
+                CASE
+                    WHEN NOT %(places)s THEN old_place
+                    WHEN forfeited THEN
+                        COUNT(*) OVER teams
+                        - COUNT(*) FILTER (WHERE forfeited) OVER teams + 1
+                    WHEN COUNT(*) FILTER (WHERE NOT forfeited) OVER teams = 1 THEN 1
+                    WHEN score IS NULL THEN NULL
+                    ELSE RANK() OVER (
+                        PARTITION BY match_id, forfeited, score IS NULL ORDER BY score
+                    )
+                END AS place
+            FROM scored
+            WINDOW teams AS (PARTITION BY match_id)
+        ),
+        updated AS (
+            UPDATE {table} AS team
+            SET score = placed.score, place = placed.place
+            FROM placed
+            WHERE team.id = placed.id
+            AND (
+                team.score IS DISTINCT FROM placed.score
+                OR team.place IS DISTINCT FROM placed.place
+            )
+            RETURNING team.id
+        )
+        SELECT
+            team.id,
+            team.match_id,
+            team.category_id,
+            team.team_num,
+            team.score_formatted,
+            team.forfeited,
+            placed.score,
+            placed.place,
+            team.score IS DISTINCT FROM placed.score AS score_changed,
+            team.place IS DISTINCT FROM placed.place AS place_changed
+        FROM {table} AS team
+        INNER JOIN placed ON placed.id = team.id
+        ORDER BY team.id
+    """
+
+    # the select sees the rows from before the update, hence the placed.* columns
+    teams = list(Team.objects.raw(query, {"match_id": match_id, "places": places}))
+
+    # score_formatted is the only thing that depends on the score
+    rescored = [team for team in teams if team.score_changed]
+    if rescored:
+        category = Category.objects.get(pk=rescored[0].category_id)
+        for team in rescored:
+            team.score_formatted = format_score(team.score, category)
+        Team.objects.bulk_update(rescored, ["score_formatted"])
+
+    return teams
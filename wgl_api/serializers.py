@@ -35,10 +35,12 @@ class FullPlayerSerializer(WritableNestedModelSerializer, serializers.ModelSeria
             "youtube",
             "in_queue",
             "queues_for",
+            "queue_joined_timestamp",
             "currently_playing_match",
             "accept_challenges",
             "banned",
         ]
+        read_only_fields = ["queue_joined_timestamp", "currently_playing_match"]
 
 
 class PlayerSerializer(WritableNestedModelSerializer, serializers.ModelSerializer):
@@ -102,8 +104,7 @@ class TeamSerializer(WritableNestedModelSerializer, serializers.ModelSerializer)
             "score_formatted",
             "forfeited",
         ]
-
-    read_only_fields = ["score_formatted"]
+        read_only_fields = ["score", "score_formatted"]
 
 
 class MatchSerializer(NestedUpdateMixin, serializers.ModelSerializer):
@@ -182,3 +183,285 @@ class ScoreSerializer(serializers.ModelSerializer):
             "player_rank",
             "non_obsolete_rank",
         ]
+
+
+# fast read-only serializers
+# these build the same json as the serializers above, but from `.values()` rows
+# instead of model instances, which skips most of drf's per-field work on big lists.
+# the view does `queryset.values(*SomeRowSerializer.values)` and passes the rows in
+
+
+PLAYER_VALUES = ("discord_id", "username", "youtube", "youtube__handle", "youtube__video_id")
+CATEGORY_VALUES = (
+    "category_id",
+    "shortcode",
+    "category_name",
+    "speedrun",
+    "require_all_livestreams",
+)
+
+datetime_field = serializers.DateTimeField()
+
+
+def prefixed(prefix, values):
+    return tuple(prefix + value for value in values)
+
+
+def player_row(row, prefix=""):
+    if row[prefix + "discord_id"] is None:
+        return None
+
+    youtube = None
+    if row[prefix + "youtube"] is not None:
+        youtube = {
+            "handle": row[prefix + "youtube__handle"],
+            "video_id": row[prefix + "youtube__video_id"],
+        }
+
+    return {
+        "discord_id": row[prefix + "discord_id"],
+        "username": row[prefix + "username"],
+        "youtube": youtube,
+    }
+
+
+def category_row(row, prefix=""):
+    return {value: row[prefix + value] for value in CATEGORY_VALUES}
+
+
+class RowListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        rows = list(data)
+
+        # fetch anything the rows need in one go, instead of once per row
+        loader = self.child.load(rows)
+        try:
+            queryset = next(loader)
+            while True:
+                queryset = loader.send(list(queryset))
+        except StopIteration:
+            pass
+
+        return [self.child.to_representation(row) for row in rows]
+
+    async def ato_representation(self, rows):
+        # same as to_representation, with the async orm
+        loader = self.child.load(rows)
+        try:
+            queryset = next(loader)
+            while True:
+                queryset = loader.send([row async for row in queryset])
+        except StopIteration:
+            pass
+
+        return [self.child.to_representation(row) for row in rows]
+
+
+class RowSerializer(serializers.BaseSerializer):
+    values = ()
+
+    class Meta:
+        list_serializer_class = RowListSerializer
+
+    def load(self, rows):
+        """
+        fetch whatever `to_representation` needs for `rows`.
+        it's a generator that yields querysets and gets their rows back,
+        so the same code works with the sync and async orm
+        """
+
+        yield from ()
+
+
+class EloRowSerializer(RowSerializer):
+    values = ("pk", "rank", "mu") + prefixed("player__", PLAYER_VALUES)
+
+    def to_representation(self, row):
+        return {
+            "pk": row["pk"],
+            "rank": row["rank"],
+            "player": player_row(row, "player__"),
+            "mu": row["mu"],
+        }
+
+
+class ScoreRowSerializer(RowSerializer):
+    values = (
+        (
+            "pk",
+            "match",
+            "score",
+            "score_formatted",
+            "overall_rank",
+            "player_rank",
+            "non_obsolete_rank",
+            # for ScoresPagination's cursor
+            "match_started",
+        )
+        + prefixed("player__", PLAYER_VALUES)
+        + prefixed("category__", CATEGORY_VALUES)
+    )
+
+    def to_representation(self, row):
+        return {
+            "pk": row["pk"],
+            "player": player_row(row, "player__"),
+            "category": category_row(row, "category__"),
+            "match": row["match"],
+            "score": row["score"],
+            "score_formatted": row["score_formatted"],
+            "overall_rank": row["overall_rank"],
+            "player_rank": row["player_rank"],
+            "non_obsolete_rank": row["non_obsolete_rank"],
+        }
+
+
+class MatchRowSerializer(RowSerializer):
+    values = (
+        "match_id",
+        "discord_thread_id",
+        "timestamp_started",
+        "timestamp_finished",
+        "num_teams",
+        "players_per_team",
+        "active",
+        "status",
+    ) + prefixed("category__", CATEGORY_VALUES)
+
+    team_values = (
+        "team__pk",
+        "team__place",
+        "team__team_num",
+        "team__score",
+        "team__score_formatted",
+        "team__forfeited",
+    )
+
+    team_player_values = (
+        "teamplayer__pk",
+        "teamplayer__score",
+        "teamplayer__score_formatted",
+        "teamplayer__video_id",
+        "teamplayer__video_timestamp",
+        "teamplayer__mu_before",
+        "teamplayer__mu_after",
+        "teamplayer__mu_delta",
+    ) + prefixed("teamplayer__player__", PLAYER_VALUES)
+
+    def load(self, rows):
+        self.teams = {row["match_id"]: [] for row in rows}
+
+        team_rows = yield Match.teams.through.objects.filter(
+            match_id__in=self.teams
+        ).order_by("team_id").values("match_id", *self.team_values)
+
+        players = {}
+        for team in team_rows:
+            players[team["team__pk"]] = []
+            self.teams[team["match_id"]].append(
+                {
+                    "pk": team["team__pk"],
+                    "place": team["team__place"],
+                    "team_num": team["team__team_num"],
+                    "players": players[team["team__pk"]],
+                    "score": team["team__score"],
+                    "score_formatted": team["team__score_formatted"],
+                    "forfeited": team["team__forfeited"],
+                }
+            )
+
+        if not players:
+            return
+
+        team_player_rows = yield Team.players.through.objects.filter(
+            team_id__in=players
+        ).order_by("teamplayer_id").values("team_id", *self.team_player_values)
+
+        for tp in team_player_rows:
+            players[tp["team_id"]].append(
+                {
+                    "pk": tp["teamplayer__pk"],
+                    "player": player_row(tp, "teamplayer__player__"),
+                    "score": tp["teamplayer__score"],
+                    "score_formatted": tp["teamplayer__score_formatted"],
+                    "video_id": tp["teamplayer__video_id"],
+                    "video_timestamp": tp["teamplayer__video_timestamp"],
+                    "mu_before": tp["teamplayer__mu_before"],
+                    "mu_after": tp["teamplayer__mu_after"],
+                    "mu_delta": tp["teamplayer__mu_delta"],
+                }
+            )
+
+    def to_representation(self, row):
+        # same order as MatchSerializer: forfeited teams last, the rest by place
+        teams = sorted(
+            self.teams[row["match_id"]],
+            key=lambda team: (
+                team["forfeited"],
+                float("inf") if team["place"] is None else team["place"],
+            ),
+        )
+
+        return {
+            "match_id": row["match_id"],
+            "discord_thread_id": row["discord_thread_id"],
+            "category": category_row(row, "category__"),
+            "timestamp_started": datetime_field.to_representation(
+                row["timestamp_started"]
+            ),
+            "timestamp_finished": datetime_field.to_representation(
+                row["timestamp_finished"]
+            ),
+            "num_teams": row["num_teams"],
+            "players_per_team": row["players_per_team"],
+            "teams": teams,
+            "active": row["active"],
+            "status": row["status"],
+        }
+
+
+class QueuePlayerRowSerializer(RowSerializer):
+    values = (
+        "created_timestamp",
+        "last_active_timestamp",
+        "in_queue",
+        "queue_joined_timestamp",
+        "currently_playing_match",
+        "accept_challenges",
+        "banned",
+    ) + PLAYER_VALUES
+
+    def load(self, rows):
+        self.queues_for = {row["discord_id"]: [] for row in rows}
+
+        queues_for = yield (
+            Player.queues_for.through.objects.filter(player_id__in=self.queues_for)
+            .order_by("category_id")
+            .values_list("player_id", "category_id")
+        )
+
+        for player_id, category_id in queues_for:
+            self.queues_for[player_id].append(category_id)
+
+    def to_representation(self, row):
+        player = player_row(row)
+
+        return {
+            "discord_id": player["discord_id"],
+            "username": player["username"],
+            "created_timestamp": datetime_field.to_representation(
+                row["created_timestamp"]
+            ),
+            "last_active_timestamp": datetime_field.to_representation(
+                row["last_active_timestamp"]
+            ),
+            "youtube": player["youtube"],
+            "in_queue": row["in_queue"],
+            "queues_for": self.queues_for[row["discord_id"]],
+            "queue_joined_timestamp": datetime_field.to_representation(
+                row["queue_joined_timestamp"]
+            ),
+            "currently_playing_match": row["currently_playing_match"],
+            "accept_challenges": row["accept_challenges"],
+            "banned": row["banned"],
+        }
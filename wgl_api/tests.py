@@ -1,3 +1,1223 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.test import (
+    AsyncRequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .matchmaking import (
+    LobbyQueue,
+    Matchmaker,
+    build_lobbies,
+    score_group,
+    score_groups,
+)
+from . import async_views
+from .computed import batch_computed_fields
+from . import events
+from .elo import STARTING_ELO, assign_elo, calculate_elo
+from .models import Category, Elo, Match, Player, TeamPlayer, Youtube
+from .queue_state import DatabaseQueueState, InMemoryQueueState
+from .rankings import refresh_elo_ranks, refresh_score_ranks
+from .serializers import (
+    EloRowSerializer,
+    EloSerializer,
+    FullPlayerSerializer,
+    MatchRowSerializer,
+    MatchSerializer,
+    QueuePlayerRowSerializer,
+    ScoreRowSerializer,
+    ScoreSerializer,
+    TeamSerializer,
+)
+from .utils import create_match
+from .views import event_stream, with_teams
+
+
+def queue_players(categories, num_players, start=0):
+    players = []
+    for i in range(start, start + num_players):
+        player = Player.objects.create(
+            discord_id=i + 1, username=f"player{i}", in_queue=True
+        )
+        player.queues_for.add(*categories)
+        players.append(player)
+    return players
+
+
+class MatchmakerTests(TestCase):
+    def setUp(self):
+        self.categories = [
+            Category.objects.create(shortcode=f"c{i}", category_name=f"Category {i}")
+            for i in range(3)
+        ]
+
+    def test_load_queue_query_count(self):
+        players = queue_players(self.categories, 5)
+        for i, player in enumerate(players[:3]):
+            Elo.objects.create(
+                player=player, category=self.categories[0], mu=1000 + i * 100
+            )
+
+        # adding more players and categories shouldn't add queries
+        with self.assertNumQueries(3):
+            Matchmaker().load_queue()
+
+        queue_players(self.categories[:2], 20, start=5)
+
+        with self.assertNumQueries(3):
+            queue = Matchmaker().load_queue()
+
+        self.assertEqual(len(queue[self.categories[0]]), 25)
+        self.assertEqual(len(queue[self.categories[2]]), 5)
+
+        mus = {player.pk: mu for player, mu, sigma in queue[self.categories[0]]}
+        self.assertEqual(mus[players[2].pk], 1200)
+        self.assertEqual(mus[players[4].pk], 1500)
+
+    def test_matchmake_puts_players_in_one_match(self):
+        queue_players(self.categories, 10)
+
+        matchmaker = Matchmaker()
+        matches = list(matchmaker.matchmake())
+
+        self.assertEqual(matchmaker.stats["snapshot_queries"], 3)
+        self.assertEqual(sum(match.teams.count() for match in matches), 10)
+        self.assertFalse(Player.objects.filter(in_queue=True).exists())
+
+    def test_failing_category_doesnt_stop_the_others(self):
+        broken, working = self.categories[:2]
+        queue_players([broken], 4)
+        queue_players([working], 4, start=4)
+
+        # fails after making the match, which has to be rolled back
+        def create_broken_match(teams, category):
+            match = create_match(teams, category)
+            if category == broken:
+                raise RuntimeError("broken")
+            return match
+
+        with mock.patch("wgl_api.matchmaking.create_match", create_broken_match):
+            with self.assertLogs("wgl_api.matchmaking", "ERROR"):
+                matches = list(Matchmaker().matchmake())
+
+        self.assertEqual([match.category_id for match in matches], [working.pk])
+        self.assertFalse(Match.objects.filter(category=broken).exists())
+        self.assertEqual(Player.objects.filter(in_queue=True).count(), 4)
+
+    def test_background_doesnt_score_joins(self):
+        player = queue_players(self.categories, 1)[0]
+        Player.objects.filter(pk=player.pk).update(in_queue=False)
+
+        matchmaker = Matchmaker()
+        with override_settings(MATCHMAKING_BACKGROUND=True):
+            matchmaker.add_player(player)
+        self.assertEqual(matchmaker.queues, {})
+
+        matchmaker.add_player(player)
+        self.assertEqual(len(matchmaker.queues), 3)
+
+    def test_matchmake_only_scores_new_players(self):
+        matchmaker = Matchmaker()
+        players = queue_players(self.categories[:1], 3)
+
+        # the first two joined through the api, so they're already scored
+        Player.objects.filter(pk__in=[p.pk for p in players[:2]]).update(in_queue=False)
+        for player in players[:2]:
+            matchmaker.add_player(player)
+        Player.objects.update(in_queue=True)
+
+        matches = list(matchmaker.matchmake())
+
+        self.assertEqual(matchmaker.stats["players_scored"], 1)
+        self.assertEqual(len(matches), 1)
+
+
+class InMemoryMatchmakerTests(TransactionTestCase):
+    # outside of TestCase's transaction, like a real request
+    def test_matchmake(self):
+        category = Category.objects.create(shortcode="c", category_name="C")
+        queue_players([category], 4)
+
+        matches = list(Matchmaker(InMemoryQueueState()).matchmake())
+
+        self.assertEqual(sum(match.teams.count() for match in matches), 4)
+
+
+class LobbyQueueTests(TestCase):
+    def test_incremental_matches_rebuild(self):
+        ratings = [(i, 1000 + (i * 37) % 500, 100 + i) for i in range(40)]
+
+        queue = LobbyQueue()
+        for rating in ratings[:20]:
+            queue.add(*rating)
+        queue.extend(ratings[20:])
+        queue.remove(3)
+        queue.add(3, *ratings[3][1:])
+
+        self.assertEqual(queue.drain(), build_lobbies(ratings))
+        self.assertEqual(len(queue), 0)
+
+    def test_score_groups_matches_score_group(self):
+        mu = np.array([1000 + (i * 37) % 500 for i in range(12)], dtype=float)
+        sigma = np.array([100 + i * 20 for i in range(12)], dtype=float)
+
+        for size in [2, 5, 8]:
+            groups = [list(range(i, i + size)) for i in range(12 - size + 1)]
+            expected = [score_group(mu[group], sigma[group]) for group in groups]
+            self.assertTrue(np.allclose(score_groups(mu, sigma, groups), expected))
+
+    def test_everyone_gets_a_lobby(self):
+        ratings = [(i, 1500 + i * 10, 500) for i in range(19)]
+
+        lobbies = build_lobbies(ratings)
+
+        self.assertEqual(sorted(sum(lobbies, [])), list(range(19)))
+        self.assertTrue(all(2 <= len(lobby) <= 8 for lobby in lobbies))
+
+
+class CreateMatchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+
+    def test_query_count_doesnt_depend_on_lobby_size(self):
+        players = queue_players([self.category], 10)
+        Elo.objects.create(player=players[0], category=self.category, mu=1234)
+
+        with self.assertNumQueries(16):
+            create_match([[player] for player in players[:2]], self.category)
+
+        with self.assertNumQueries(16):
+            match = create_match([[player] for player in players[2:]], self.category)
+
+        self.assertEqual(match.teams.count(), 8)
+        self.assertEqual(
+            Player.objects.filter(currently_playing_match=match).count(), 8
+        )
+        self.assertFalse(Player.objects.filter(in_queue=True).exists())
+        self.assertEqual(Elo.objects.filter(category=self.category).count(), 10)
+
+        tp = TeamPlayer.objects.get(player=players[0])
+        self.assertEqual(tp.mu_before, 1234)
+        self.assertEqual(tp.category_id, self.category.pk)
+        self.assertEqual(tp.score_formatted, "—")
+
+
+class MatchSaveTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 3)
+        self.match = create_match([[player] for player in players], self.category)
+        self.match.status = "Ongoing"
+        self.match.save()
+
+    def report_scores(self, *scores):
+        for tp, score in zip(TeamPlayer.objects.order_by("pk"), scores):
+            tp.score = score
+            tp.save()
+
+    def places(self):
+        return [team.place for team in self.match.teams.order_by("pk")]
+
+    def test_placements_and_previews(self):
+        self.report_scores(300, 100, 300)
+        match = Match.objects.get(pk=self.match.pk)
+        match.save()
+
+        self.assertEqual(self.places(), [2, 1, 2])
+        self.assertEqual(match.status, "Waiting for agrees")
+        self.assertFalse(TeamPlayer.objects.filter(mu_after__isnull=True).exists())
+
+        team = match.teams.get(team_num="B")
+        team.forfeited = True
+        team.save()
+        match.save()
+
+        self.assertEqual(self.places(), [1, 3, 1])
+
+    def test_team_score_is_read_only(self):
+        team = self.match.teams.get(team_num="A")
+
+        serializer = TeamSerializer(team, data={"score": 5}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        # it's only ever the sum of the players' scores, which nobody has yet
+        team.refresh_from_db()
+        self.assertIsNone(team.score)
+
+    def test_unrelated_save_doesnt_recompute(self):
+        self.report_scores(300, 100, 200)
+        Match.objects.get(pk=self.match.pk).save()
+
+        match = Match.objects.get(pk=self.match.pk)
+        match.discord_thread_id = 1234
+
+        # the teams lookup and an update of just discord_thread_id
+        with self.assertNumQueries(2):
+            match.save()
+
+    def playing(self):
+        return sorted(
+            Player.objects.filter(currently_playing_match=self.match).values_list(
+                "pk", flat=True
+            )
+        )
+
+    def test_currently_playing_match(self):
+        self.assertEqual(self.playing(), [1, 2, 3])
+
+        team = self.match.teams.get(team_num="B")
+        team.forfeited = True
+        team.save()
+        self.assertEqual(self.playing(), [1, 3])
+
+        team.forfeited = False
+        team.save()
+        self.assertEqual(self.playing(), [1, 2, 3])
+
+        # saving it again without touching the forfeit leaves the players alone
+        with CaptureQueriesContext(connection) as queries:
+            team.save()
+        self.assertFalse(
+            any(
+                f'"{Player._meta.db_table}"' in query["sql"]
+                for query in queries.captured_queries
+            )
+        )
+
+        match = Match.objects.get(pk=self.match.pk)
+        match.status = "Cancelled"
+
+        # the teams lookup and the update, then the players are moved out of it in bulk
+        # (no recomputing every player of the match one by one)
+        with self.assertNumQueries(4):
+            match.save()
+        self.assertEqual(self.playing(), [])
+
+        match.status = "Ongoing"
+        match.save()
+        self.assertEqual(self.playing(), [1, 2, 3])
+
+    def test_calculate_elo_query_count(self):
+        self.report_scores(300, 100, 200)
+        match = Match.objects.get(pk=self.match.pk)
+        match.save()
+
+        # teams, players and one bulk update
+        with self.assertNumQueries(3):
+            calculate_elo(match)
+
+        tp = TeamPlayer.objects.get(team__place=1)
+        self.assertGreater(tp.mu_after, tp.mu_before)
+        self.assertEqual(tp.mu_delta, f"+{tp.mu_after - tp.mu_before}")
+
+    def test_assign_elo(self):
+        self.report_scores(300, 100, 200)
+        Match.objects.get(pk=self.match.pk).save()
+
+        # team players, locked elos, one bulk update and the leaderboard ranks + revision
+        with self.assertNumQueries(7):
+            assign_elo(self.match)
+
+        for tp in TeamPlayer.objects.all():
+            elo = Elo.objects.get(player=tp.player, category=self.category)
+            self.assertEqual(elo.mu, tp.mu_after)
+            self.assertAlmostEqual(elo.sigma, tp.sigma_after)
+
+    def test_overlapping_matches(self):
+        # player 1 forfeits out of the first match and finishes another one before it
+        first = self.match
+        team = first.teams.get(team_num="A")
+        team.forfeited = True
+        team.save()
+
+        second = create_match(
+            [[Player.objects.get(pk=1)], queue_players([self.category], 1, start=3)],
+            self.category,
+        )
+
+        for match, scores in [(second, [100, 200]), (first, [300, 100, 200])]:
+            for tp, score in zip(
+                TeamPlayer.objects.filter(match=match).order_by("pk"), scores
+            ):
+                tp.score = score
+                tp.save()
+            match = Match.objects.get(pk=match.pk)
+            match.save()
+            assign_elo(match)
+
+        # both matches count, the second one isn't overwritten by the first
+        tps = TeamPlayer.objects.filter(player=1)
+        self.assertEqual(
+            Elo.objects.get(player=1, category=self.category).mu,
+            STARTING_ELO + sum(tp.mu_after - tp.mu_before for tp in tps),
+        )
+
+    def test_finished_twice(self):
+        self.report_scores(300, 100, 200)
+        Match.objects.get(pk=self.match.pk).save()
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="bot"))
+        for _ in range(2):
+            response = client.patch(
+                f"/v1/match/{self.match.match_id}", {"status": "Finished"}, format="json"
+            )
+            self.assertEqual(response.status_code, 200)
+
+        # the retry doesn't count the match again
+        for tp in TeamPlayer.objects.filter(match=self.match):
+            self.assertEqual(
+                Elo.objects.get(player=tp.player, category=self.category).mu, tp.mu_after
+            )
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+
+    def assertRanksUpToDate(self):
+        expected = dict(
+            Elo.objects.filter(category=self.category)
+            .annotate(expected=Window(expression=Rank(), order_by=F("mu").desc()))
+            .values_list("pk", "expected")
+        )
+        ranks = dict(
+            Elo.objects.filter(category=self.category).values_list("pk", "rank")
+        )
+        self.assertEqual(ranks, expected)
+
+    def test_ranks_follow_matches(self):
+        players = queue_players([self.category], 6)
+        for i, player in enumerate(players[:3]):
+            Elo.objects.create(player=player, category=self.category, mu=1400 + i * 50)
+
+        match = create_match([[player] for player in players], self.category)
+        self.assertRanksUpToDate()
+
+        for i, tp in enumerate(TeamPlayer.objects.filter(match=match).order_by("pk")):
+            tp.score = i
+            tp.save()
+        match = Match.objects.get(pk=match.pk)
+        match.save()
+        assign_elo(match)
+
+        self.assertRanksUpToDate()
+        self.assertEqual(
+            Elo.objects.filter(category=self.category).order_by("rank").first().player,
+            players[0],
+        )
+
+    def test_pagination(self):
+        players = queue_players([self.category], 60)
+        Elo.objects.bulk_create(
+            [
+                Elo(player=player, category=self.category, mu=1000 + i)
+                for i, player in enumerate(players)
+            ]
+        )
+        refresh_elo_ranks(self.category.pk)
+
+        url = f"/v1/leaderboard/{self.category.pk}"
+
+        response = self.client.get(url).json()
+        self.assertNotIn("count", response)
+        self.assertEqual(len(response["results"]), 50)
+        self.assertEqual(response["results"][0]["mu"], 1059)
+
+        response = self.client.get(response["next"]).json()
+        self.assertEqual([elo["rank"] for elo in response["results"]], list(range(51, 61)))
+
+        # and back
+        response = self.client.get(response["previous"]).json()
+        self.assertEqual(response["results"][0]["mu"], 1059)
+        self.assertIsNone(response["previous"])
+
+        # the old page numbers still work
+        response = self.client.get(url, {"page": 2}).json()
+        self.assertEqual(response["count"], 60)
+        self.assertEqual(response["results"][0]["rank"], 51)
+
+    def test_pagination_through_ties(self):
+        # everyone starts on the same mu, so they all share a rank
+        players = Player.objects.bulk_create(
+            [Player(discord_id=i + 1, username=f"player{i}") for i in range(1100)]
+        )
+        Elo.objects.bulk_create(
+            [Elo(player=player, category=self.category) for player in players]
+        )
+        refresh_elo_ranks(self.category.pk)
+
+        seen = []
+        url = f"/v1/leaderboard/{self.category.pk}"
+        while url:
+            response = self.client.get(url).json()
+            seen += [elo["pk"] for elo in response["results"]]
+            url = response["next"]
+
+        self.assertEqual(len(seen), 1100)
+        self.assertEqual(seen, sorted(set(seen)))
+
+
+class ScoreRankTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        self.players = queue_players([self.category], 3)
+
+    def play(self, *scores, status="Finished"):
+        match = create_match([[player] for player in self.players], self.category)
+        for tp, score in zip(TeamPlayer.objects.filter(match=match).order_by("pk"), scores):
+            tp.score = score
+            tp.save()
+
+        match = Match.objects.get(pk=match.pk)
+        match.status = status
+        match.save()
+        return match
+
+    def ranks(self):
+        return list(
+            TeamPlayer.objects.filter(overall_rank__isnull=False)
+            .order_by("overall_rank", "pk")
+            .values_list("score", "overall_rank", "player_rank", "non_obsolete_rank")
+        )
+
+    def test_ranks(self):
+        self.play(100, 200, 300)
+        second = self.play(150, 50, 400)
+        self.play(1, 1, 1, status="Ongoing")
+
+        self.assertEqual(
+            self.ranks(),
+            [
+                (50, 1, 1, 1),
+                (100, 2, 1, 2),
+                (150, 3, 2, None),
+                (200, 4, 2, None),
+                (300, 5, 1, 5),
+                (400, 6, 2, None),
+            ],
+        )
+
+        second.status = "Result contested"
+        second.save()
+
+        self.assertEqual(
+            self.ranks(), [(100, 1, 1, 1), (200, 2, 1, 2), (300, 3, 1, 3)]
+        )
+        self.assertFalse(
+            TeamPlayer.objects.filter(match=second, match_finished=True).exists()
+        )
+
+    def test_corrected_scores(self):
+        first = self.play(100, 200, 300)
+        self.play(150, 250, 350)
+
+        # a finished match's result gets corrected
+        with batch_computed_fields():
+            for tp, score in zip(
+                TeamPlayer.objects.filter(match=first).order_by("pk"), [400, 200, 50]
+            ):
+                tp.score = score
+                tp.save()
+
+        self.assertEqual(
+            self.ranks(),
+            [
+                (50, 1, 1, 1),
+                (150, 2, 1, 2),
+                (200, 3, 1, 3),
+                (250, 4, 2, None),
+                (350, 5, 2, None),
+                (400, 6, 2, None),
+            ],
+        )
+
+
+class QueueStateTests(TestCase):
+    def check_delay(self, state):
+        state.add_delay(amount=2)
+
+        for _ in range(2):
+            with state.matchmaking_pass() as ready:
+                self.assertFalse(ready)
+
+        with state.matchmaking_pass() as ready:
+            self.assertTrue(ready)
+
+        self.assertEqual(state.get_delay(), 0)
+
+    def test_in_memory_delay(self):
+        self.check_delay(InMemoryQueueState())
+
+    def test_database_delay(self):
+        self.check_delay(DatabaseQueueState())
+
+        # a second worker sees the same counter
+        DatabaseQueueState().add_delay()
+        self.assertEqual(DatabaseQueueState().get_delay(), 1)
+
+
+class MatchQueryTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+
+    def make_matches(self, num_matches, start=0):
+        return [
+            create_match(
+                [[player] for player in queue_players([self.category], 4, start=start + i * 4)],
+                self.category,
+            )
+            for i in range(num_matches)
+        ]
+
+    def test_match_list_query_count(self):
+        self.make_matches(1)
+
+        # matches, teams and team players, no matter how many matches
+        with self.assertNumQueries(3):
+            self.client.get("/v1/match")
+
+        self.make_matches(5, start=4)
+
+        with self.assertNumQueries(3):
+            response = self.client.get("/v1/match").json()
+
+        # still a plain list unless a cursor or page is asked for
+        self.assertEqual(len(response), 6)
+        self.assertEqual(len(response[0]["teams"]), 4)
+        self.assertEqual(
+            response[0]["teams"][0]["players"][0]["player"]["username"][:6], "player"
+        )
+
+        page = self.client.get("/v1/match", {"cursor": ""}).json()
+        self.assertEqual(page["results"], response)
+        self.assertIsNone(page["next"])
+
+    def test_match_detail_query_count(self):
+        match = self.make_matches(1)[0]
+
+        # plus the etag lookup
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/v1/match/{match.match_id}").json()
+
+        self.assertEqual(len(response["teams"]), 4)
+
+
+class RowSerializerTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        self.players = queue_players([self.category], 4)
+        self.players[0].youtube = Youtube.objects.create(handle="@p0", video_id="abc")
+        self.players[0].save()
+
+        for scores in [(300, 100, 200, 400), (100, 100, None, 50)]:
+            match = create_match([[player] for player in self.players], self.category)
+            for tp, score in zip(
+                TeamPlayer.objects.filter(match=match).order_by("pk"), scores
+            ):
+                tp.score = score
+                tp.save()
+
+            match = Match.objects.get(pk=match.pk)
+            match.status = "Finished"
+            match.save()
+
+        queue_players([self.category], 3, start=4)
+
+    def assertSameJson(self, row_serializer, serializer, queryset, normalize=None):
+        rows = row_serializer(queryset.values(*row_serializer.values), many=True).data
+        expected = serializer(queryset, many=True).data
+
+        rows, expected = json.loads(json.dumps(rows)), json.loads(json.dumps(expected))
+        if normalize is not None:
+            rows, expected = normalize(rows), normalize(expected)
+
+        self.assertTrue(rows)
+        self.assertEqual(rows, expected)
+
+    def test_elo_rows(self):
+        self.assertSameJson(
+            EloRowSerializer, EloSerializer, Elo.objects.order_by("rank", "pk")
+        )
+
+    def test_score_rows(self):
+        self.assertSameJson(
+            ScoreRowSerializer,
+            ScoreSerializer,
+            TeamPlayer.objects.filter(overall_rank__isnull=False).order_by("pk"),
+        )
+
+    def test_match_rows(self):
+        def normalize(matches):
+            # the model serializer doesn't order teams or players within a place
+            for match in matches:
+                for team in match["teams"]:
+                    team["players"].sort(key=lambda tp: tp["pk"])
+                match["teams"].sort(key=lambda team: team["pk"])
+            return matches
+
+        self.assertSameJson(
+            MatchRowSerializer,
+            MatchSerializer,
+            with_teams(Match.objects.order_by("pk")),
+            normalize,
+        )
+
+    def test_queue_rows(self):
+        self.assertSameJson(
+            QueuePlayerRowSerializer,
+            FullPlayerSerializer,
+            Player.objects.filter(in_queue=True).order_by("pk"),
+        )
+
+        response = self.client.get(f"/v1/queue/{self.category.pk}").json()
+        self.assertEqual(len(response), 3)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        self.other = Category.objects.create(shortcode="o", category_name="O")
+
+    def test_categories(self):
+        self.client.get("/v1/category")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/v1/category").json()
+        self.assertEqual(len(response), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.category_name = "Renamed"
+            self.category.save()
+
+        response = self.client.get("/v1/category/c").json()
+        self.assertEqual(response["category_name"], "Renamed")
+
+    def test_leaderboard_follows_elo_changes(self):
+        players = queue_players([self.category, self.other], 3)
+        url = f"/v1/leaderboard/{self.category.pk}"
+        other_url = f"/v1/leaderboard/{self.other.pk}"
+
+        self.client.get(url)
+        self.client.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            match = create_match([[player] for player in players], self.category)
+        for tp, score in zip(TeamPlayer.objects.order_by("pk"), [100, 200, 300]):
+            tp.score = score
+            tp.save()
+        match = Match.objects.get(pk=match.pk)
+        match.save()
+
+        response = self.client.get(url).json()
+        self.assertEqual(len(response["results"]), 3)
+
+        # the other category's leaderboard didn't change, so it stays cached
+        # (the one query is the etag lookup)
+        with self.assertNumQueries(1):
+            self.client.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_elo(match)
+
+        response = self.client.get(url).json()
+        self.assertEqual(response["results"][0]["player"]["discord_id"], players[0].pk)
+        self.assertEqual(
+            response["results"][0]["mu"],
+            Elo.objects.get(player=players[0], category=self.category).mu,
+        )
+
+        scores_url = f"/v1/scores/{self.category.pk}"
+        self.assertEqual(self.client.get(scores_url).json()["results"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            match.status = "Finished"
+            match.save()
+
+        self.assertEqual(len(self.client.get(scores_url).json()["results"]), 3)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 2)
+        self.match = create_match([[player] for player in players], self.category)
+
+    def assertNotModified(self, url, etag):
+        # just the etag lookup, nothing gets serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_match(self):
+        url = f"/v1/match/{self.match.match_id}"
+
+        etag = self.client.get(url).headers["ETag"]
+        self.assertNotModified(url, etag)
+
+        # a player's score changes the match
+        tp = TeamPlayer.objects.filter(match=self.match).first()
+        tp.score = 100
+        tp.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        etag = response.headers["ETag"]
+
+        match = Match.objects.get(pk=self.match.pk)
+        match.discord_thread_id = 1234
+        match.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["discord_thread_id"], 1234)
+
+        self.assertEqual(self.client.get("/v1/match/999999").status_code, 404)
+
+    def test_leaderboard(self):
+        url = f"/v1/leaderboard/{self.category.pk}"
+
+        etag = self.client.get(url).headers["ETag"]
+        self.assertNotModified(url, etag)
+
+        for tp, score in zip(TeamPlayer.objects.order_by("pk"), [100, 200]):
+            tp.score = score
+            tp.save()
+        match = Match.objects.get(pk=self.match.pk)
+        match.save()
+        assign_elo(match)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        # the cached page is keyed on the etag, so it isn't reused for the new one
+        self.assertEqual(
+            [elo["mu"] for elo in response.json()["results"]],
+            list(Elo.objects.order_by("rank", "pk").values_list("mu", flat=True)),
+        )
+
+
+class ComputedFieldsBatchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 4)
+        self.match = create_match(
+            [players[:2], players[2:]], self.category
+        )
+        self.match.status = "Ongoing"
+        self.match.save()
+
+    def test_batch(self):
+        with batch_computed_fields() as batch:
+            for tp, score in zip(TeamPlayer.objects.order_by("pk"), [100, 200, 50, 60]):
+                tp.score = score
+                tp.save()
+
+            # not resolved yet
+            self.assertEqual(
+                list(self.match.teams.order_by("pk").values_list("score", flat=True)),
+                [None, None],
+            )
+
+        self.assertEqual(batch.stats, {"saves": 4, "resolves": 1})
+        self.assertEqual(batch.avoided, 3)
+        self.assertEqual(
+            list(self.match.teams.order_by("pk").values_list("score", flat=True)),
+            [300, 110],
+        )
+
+    def test_match_update(self):
+        teams = [
+            {
+                "pk": team.pk,
+                "players": [
+                    {"pk": tp.pk, "score": 100 + team.pk * 10 + i}
+                    for i, tp in enumerate(team.players.order_by("pk"))
+                ],
+            }
+            for team in self.match.teams.order_by("pk")
+        ]
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="bot"))
+        response = client.patch(
+            f"/v1/match/{self.match.match_id}", {"teams": teams}, format="json"
+        ).json()
+
+        self.assertEqual(response["status"], "Waiting for agrees")
+        self.assertEqual([team["place"] for team in response["teams"]], [1, 2])
+        self.assertEqual(
+            response["teams"][0]["score"],
+            sum(tp["score"] for tp in teams[0]["players"]),
+        )
+        self.assertTrue(
+            all(tp["mu_after"] is not None for tp in response["teams"][0]["players"])
+        )
+
+
+class TeamScoreTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 6)
+        self.match = create_match(
+            [players[:2], players[2:4], players[4:]], self.category
+        )
+
+    def teams(self):
+        return list(
+            self.match.teams.order_by("pk").values_list("score", "place", "score_formatted")
+        )
+
+    def test_scores_and_places(self):
+        tps = list(TeamPlayer.objects.order_by("pk"))
+        for tp, score in zip(tps, [100, 50, 75, 75, 10, None]):
+            tp.score = score
+            tp.save()
+
+        # places wait for the match
+        self.assertEqual(
+            self.teams(),
+            [(150, None, "0.150"), (150, None, "0.150"), (None, None, "—")],
+        )
+
+        with self.assertNumQueries(1):
+            teams, changed = self.match.update_placements()
+        self.assertTrue(changed)
+        self.assertEqual([team.place for team in teams], [1, 1, None])
+
+        team = self.match.teams.get(team_num="A")
+        team.forfeited = True
+        team.save()
+        self.match.update_placements()
+        self.assertEqual([place for score, place, _ in self.teams()], [3, 1, None])
+
+        self.match.teams.filter(team_num="C").update(forfeited=True)
+        self.match.update_placements()
+        self.assertEqual([place for score, place, _ in self.teams()], [2, 1, 2])
+
+
+PLANNER_SETTINGS = [
+    "enable_seqscan",
+    "enable_bitmapscan",
+    "enable_sort",
+    "enable_incremental_sort",
+]
+
+
+class IndexTests(TestCase):
+    """
+    EXPLAIN the queries behind the hot endpoints and check they can use their indexes.
+    the test tables are tiny, so postgres would rightly scan and sort them instead.
+    sequential scans, bitmap scans and (incremental) sorts are turned off while explaining,
+    so the plans show the index that fits each query like it would on big tables
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 8)
+        self.match = create_match([[player] for player in players[:4]], self.category)
+
+        for tp, score in zip(TeamPlayer.objects.order_by("pk"), [100, 200, 300, 400]):
+            tp.score = score
+            tp.save()
+        self.match = Match.objects.get(pk=self.match.pk)
+        self.match.save()
+
+    def plans(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+
+        plans = []
+        with connection.cursor() as cursor:
+            for setting in PLANNER_SETTINGS:
+                cursor.execute(f"SET {setting} = off")
+            try:
+                for query in queries.captured_queries:
+                    sql = query["sql"].strip()
+                    if not sql.upper().startswith(("SELECT", "UPDATE", "WITH", "DELETE")):
+                        continue
+
+                    cursor.execute(f"EXPLAIN {sql}")
+                    plans.extend(row[0] for row in cursor.fetchall())
+            finally:
+                for setting in PLANNER_SETTINGS:
+                    cursor.execute(f"RESET {setting}")
+
+        return "\n".join(plans)
+
+    def assertUsesIndexes(self, run, *indexes):
+        plan = self.plans(run)
+        for index in indexes:
+            self.assertIn(index, plan, f"{index} isn't used:\n{plan}")
+
+    def test_queue(self):
+        self.assertUsesIndexes(
+            lambda: self.client.get(f"/v1/queue/{self.category.pk}"),
+            "player_in_queue_idx",
+        )
+        self.assertUsesIndexes(lambda: Matchmaker().load_queue(), "player_in_queue_idx")
+
+    def test_active_matches(self):
+        self.assertUsesIndexes(
+            lambda: self.client.get("/v1/match", {"active": "true"}), "match_active_idx"
+        )
+
+    def test_leaderboard(self):
+        self.assertUsesIndexes(
+            lambda: self.client.get(f"/v1/leaderboard/{self.category.pk}"),
+            Elo._meta.indexes[0].name,
+        )
+        self.assertUsesIndexes(
+            lambda: refresh_elo_ranks(self.category.pk, 1400, 1600),
+            "elo_category_mu_idx",
+        )
+
+        # looking up the players' elos when making a match
+        players = Player.objects.filter(in_queue=True).order_by("pk")
+        self.assertUsesIndexes(
+            lambda: create_match([[player] for player in players], self.category),
+            "elo_player_category_unique",
+        )
+
+    def test_scores(self):
+        self.match.status = "Finished"
+        self.match.save()
+        self.assertUsesIndexes(
+            lambda: refresh_score_ranks(self.category.pk, 100, 300),
+            "teamplayer_scores_idx",
+        )
+        self.assertUsesIndexes(
+            lambda: self.client.get(f"/v1/scores/{self.category.pk}"),
+            TeamPlayer._meta.indexes[0].name,
+        )
+
+
+class RecordingBroadcaster:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, event):
+        self.published.append(event)
+
+
+@override_settings(EVENTS_BROADCASTER="wgl_api.tests.RecordingBroadcaster")
+class EventTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        self.players = queue_players([self.category], 2)
+        self.published = events.get_broadcaster().published
+        self.published.clear()
+
+    def test_broadcaster(self):
+        broadcaster = events.InMemoryBroadcaster()
+
+        async def listen():
+            with broadcaster.subscribe() as subscription:
+                # published from another thread, like a sync view would
+                thread = threading.Thread(
+                    target=broadcaster.publish, args=({"type": "test"},)
+                )
+                thread.start()
+                event = await asyncio.wait_for(subscription.get(), timeout=5)
+                thread.join()
+                return event
+
+        self.assertEqual(asyncio.run(listen()), {"type": "test"})
+        self.assertEqual(broadcaster.subscriptions, set())
+
+    def test_published_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            match = create_match([[player] for player in self.players], self.category)
+
+        # nothing goes out before the commit
+        self.assertEqual(self.published, [])
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(
+            [event["type"] for event in self.published],
+            [events.LEADERBOARD_CHANGED, events.MATCH_CREATED],
+        )
+        self.assertEqual(self.published[1]["match_id"], match.match_id)
+
+    def test_match_update(self):
+        match = create_match([[player] for player in self.players], self.category)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="bot"))
+        with self.captureOnCommitCallbacks(execute=True):
+            client.patch(
+                f"/v1/match/{match.match_id}", {"status": "Ongoing"}, format="json"
+            )
+
+        self.assertEqual(
+            self.published,
+            [
+                {
+                    "type": events.MATCH_STATUS,
+                    "match_id": match.match_id,
+                    "category_id": self.category.pk,
+                    "status": "Ongoing",
+                    "old_status": "Waiting for livestreams",
+                }
+            ],
+        )
+
+    def test_queue_update(self):
+        player = self.players[0]
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="bot"))
+        for in_queue in [False, False, True]:
+            with self.captureOnCommitCallbacks(execute=True):
+                client.patch(
+                    f"/v1/player/{player.discord_id}", {"in_queue": in_queue}, format="json"
+                )
+
+        # leaving twice is only one event
+        self.assertEqual(
+            [event["type"] for event in self.published],
+            [events.QUEUE_LEFT, events.QUEUE_JOINED],
+        )
+        self.assertEqual(self.published[0]["player_id"], player.pk)
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get("/v1/events").status_code, 501)
+
+    @override_settings(EVENTS_BROADCASTER="wgl_api.events.InMemoryBroadcaster")
+    def test_stream(self):
+        async def listen():
+            request = AsyncRequestFactory().get(
+                "/v1/events", {"category_id": self.category.pk}
+            )
+            response = await event_stream(request)
+            content = aiter(response.streaming_content)
+
+            first = await anext(content)
+            await content.aclose()
+            return first, response
+
+        first, response = async_to_sync(listen)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(first, b"retry: 5000\n\n")
+
+    def test_filters(self):
+        event = {"type": events.MATCH_CREATED, "match_id": 1, "category_id": 2}
+
+        self.assertTrue(events.event_matches(event, {"category_id": "2"}))
+        self.assertFalse(events.event_matches(event, {"category_id": "3"}))
+        self.assertFalse(events.event_matches(event, {"player_id": "1"}))
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(shortcode="c", category_name="C")
+        players = queue_players([self.category], 5)
+        self.match = create_match([players[:2], players[2:4]], self.category)
+
+    def get(self, view, url, headers={}, **kwargs):
+        request = AsyncRequestFactory().get(url, headers=headers)
+        return async_to_sync(view)(request, **kwargs)
+
+    def assertSameAsSync(self, view, url, **kwargs):
+        expected = self.client.get(url)
+        cache.clear()
+
+        response = self.get(view, url, **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(json.loads(response.content), expected.json())
+        self.assertEqual(response.headers.get("ETag"), expected.headers.get("ETag"))
+        return response
+
+    def test_same_as_sync(self):
+        self.assertSameAsSync(async_views.category_list, "/v1/category")
+        self.assertSameAsSync(
+            async_views.leaderboard_detail,
+            f"/v1/leaderboard/{self.category.pk}",
+            category_id=self.category.pk,
+        )
+        self.assertSameAsSync(async_views.match_list, "/v1/match?active=true")
+        self.assertSameAsSync(
+            async_views.match_detail,
+            f"/v1/match/{self.match.match_id}",
+            match_id=self.match.match_id,
+        )
+        self.assertSameAsSync(
+            async_views.queue_list,
+            f"/v1/queue/{self.category.pk}",
+            category_id=self.category.pk,
+        )
+
+    def test_shares_sync_cache(self):
+        url = f"/v1/leaderboard/{self.category.pk}"
+        expected = self.client.get(url).json()
+
+        # without invalidating, so only a cached leaderboard still has the old mus
+        Elo.objects.filter(category=self.category).update(mu=F("mu") + 1)
+
+        response = self.get(
+            async_views.leaderboard_detail, url, category_id=self.category.pk
+        )
+        self.assertEqual(json.loads(response.content), expected)
+
+    def test_not_found(self):
+        self.assertSameAsSync(async_views.match_detail, "/v1/match/0", match_id=0)
+        self.assertSameAsSync(
+            async_views.leaderboard_detail, "/v1/leaderboard/0", category_id=0
+        )
+
+        # an invalid cursor
+        self.assertSameAsSync(async_views.match_list, "/v1/match?cursor=garbage")
+        response = self.assertSameAsSync(
+            async_views.leaderboard_detail,
+            f"/v1/leaderboard/{self.category.pk}?cursor=garbage",
+            category_id=self.category.pk,
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        url = f"/v1/match/{self.match.match_id}"
+        etag = self.get(async_views.match_detail, url, match_id=self.match.match_id)[
+            "ETag"
+        ]
+
+        response = self.get(
+            async_views.match_detail,
+            url,
+            headers={"If-None-Match": etag},
+            match_id=self.match.match_id,
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_cursor(self):
+        for _ in range(60):
+            create_match([[], []], self.category)
+
+        url = "/v1/match?cursor="
+        while url:
+            page = json.loads(self.get(async_views.match_list, url).content)
+            self.assertEqual(page, self.client.get(url).json())
+            url = page["next"] and page["next"].replace("http://testserver", "")
@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 
+from . import async_views
+
 from .views import (
     MatchmakeView,
     PlayerList,
@@ -15,6 +18,7 @@ from .views import (
     ScoresDetail,
     CategoryList,
     CategoryDetail,
+    event_stream,
 )
 
 urlpatterns = [
@@ -33,4 +37,15 @@ urlpatterns = [
     path("category", CategoryList.as_view()),
     path("category/<str:shortcode>", CategoryDetail.as_view()),
     path("matchmake", MatchmakeView.as_view()),
+    path("events", event_stream),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    # same urls, served by async_views.py
+    urlpatterns = [
+        path("match", async_views.match_list),
+        path("match/<int:match_id>", async_views.match_detail),
+        path("queue/<int:category_id>", async_views.queue_list),
+        path("leaderboard/<int:category_id>", async_views.leaderboard_detail),
+        path("category", async_views.category_list),
+    ] + urlpatterns
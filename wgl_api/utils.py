@@ -1,34 +1,120 @@
-def create_match(teams, category):
-    from .models import Match, Team, TeamPlayer, Elo
+from django.db import connection, transaction
+
+from computedfields.models import update_computedfields
+
+from . import events
+from .rankings import refresh_elo_ranks
 
-    # start a match
-    match = Match.objects.create(
-        category=category,
-    )
 
-    # add teams to match
+class QueryCounter:
+    """
+    counts the queries that run inside a `with` block
 
-    for i, team in enumerate(teams):
-        t = Team.objects.create(match=match, team_num="ABCDEFGHIJKLMNOPQRSTUVWXYZ"[i])
-        for player in team:
-            # add players to teams
-            tp = TeamPlayer.objects.create(match=match, team=t, player=player)
-            t.players.add(tp)
+        with QueryCounter() as queries:
+            ...
+        print(queries.count)
+    """
 
-            # make players not queue anymore
-            player.in_queue = False
-            player.save()
+    def __init__(self):
+        self.count = 0
 
-            # find the player's elo or create a new one if it doesn't exist
-            elo = Elo.objects.filter(player=player, category=category).first()
-            if not elo:
-                elo = Elo.objects.create(player=player, category=category)
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
 
-            tp.mu_before = elo.mu
-            tp.sigma_before = elo.sigma
-            tp.save()
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
 
-        match.teams.add(t)
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+def create_match(teams, category):
+    """
+    start a match between `teams` (lists of players) in `category`
+
+    everything is created in bulk in one transaction, so the number of
+    queries doesn't depend on how many players there are
+    """
+
+    from .models import Match, Team, TeamPlayer, Elo, Player
+
+    players = [player for team in teams for player in team]
+
+    with transaction.atomic():
+        # start a match
+        match = Match.objects.create(
+            category=category,
+        )
+
+        # find the players' elos and create the ones that don't exist yet
+        elos = {
+            elo.player_id: elo
+            for elo in Elo.objects.filter(category=category, player__in=players)
+        }
+        missing = [
+            Elo(player=player, category=category)
+            for player in players
+            if player.pk not in elos
+        ]
+        # another match could've been made for the same new player at the same time,
+        # in which case their elo is already there with the same defaults
+        for elo in Elo.objects.bulk_create(missing, ignore_conflicts=True):
+            elos[elo.player_id] = elo
+
+        # new players go on the leaderboard, pushing down everyone below them
+        if missing:
+            refresh_elo_ranks(category.pk, highest_mu=max(elo.mu for elo in missing))
+
+        # add teams to match
+        team_objs = [
+            Team(match=match, team_num="ABCDEFGHIJKLMNOPQRSTUVWXYZ"[i])
+            for i in range(len(teams))
+        ]
+        for t in team_objs:
+            update_computedfields(t)
+        Team.objects.bulk_create(team_objs)
+
+        # add players to teams
+        tps = []
+        for t, team in zip(team_objs, teams):
+            for player in team:
+                tp = TeamPlayer(
+                    match=match,
+                    team=t,
+                    player=player,
+                    mu_before=elos[player.pk].mu,
+                    sigma_before=elos[player.pk].sigma,
+                    match_started=match.timestamp_started,
+                )
+                update_computedfields(tp)
+                tps.append(tp)
+        TeamPlayer.objects.bulk_create(tps)
+
+        Team.players.through.objects.bulk_create(
+            [
+                Team.players.through(team_id=tp.team_id, teamplayer_id=tp.pk)
+                for tp in tps
+            ]
+        )
+        Match.teams.through.objects.bulk_create(
+            [Match.teams.through(match_id=match.pk, team_id=t.pk) for t in team_objs]
+        )
+
+        # make players not queue anymore, and put them in the match
+        Player.objects.filter(pk__in=[player.pk for player in players]).update(
+            in_queue=False, queue_joined_timestamp=None, currently_playing_match=match
+        )
+
+        # the players also left the queue, queue listeners should refetch on this too
+        events.publish(
+            events.MATCH_CREATED,
+            match_id=match.pk,
+            category_id=category.pk,
+            player_ids=[player.pk for player in players],
+        )
 
     return match
 
@@ -1,27 +1,27 @@
+import asyncio
 from datetime import datetime
 
+from django.conf import settings
+from django.db.models import Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import (
-    Window,
-    F,
-    Q,
-    Case,
-    When,
-    Value,
-    IntegerField,
-    Subquery,
-)
-from django.db.models.functions import Rank
-
 from django.utils import timezone
 
-from django_cte import With
-
 from rest_framework import status, permissions, generics, mixins
 from rest_framework.response import Response
 from rest_framework.exceptions import APIException
 
+from .cache import (
+    CATEGORIES,
+    CachedResponseMixin,
+    ConditionalGetMixin,
+    leaderboard_scope,
+    scores_scope,
+)
+from .computed import batch_computed_fields
 from .elo import assign_elo
+from . import events
 
 from .models import (
     Category,
@@ -30,6 +30,7 @@ from .models import (
     Challenge,
     Elo,
     Score,
+    Team,
     TeamPlayer,
     Youtube,
 )
@@ -39,11 +40,13 @@ from .serializers import (
     MatchSerializer,
     FullPlayerSerializer,
     ChallengeSerializer,
-    EloSerializer,
-    ScoreSerializer,
+    EloRowSerializer,
+    ScoreRowSerializer,
+    MatchRowSerializer,
+    QueuePlayerRowSerializer,
 )
 
-from .paginations import RankingPagination
+from .paginations import LeaderboardPagination, MatchPagination, ScoresPagination
 
 from .matchmaking import Matchmaker
 
@@ -51,6 +54,39 @@ from .matchmaking import Matchmaker
 matchmaker = Matchmaker()
 
 
+def match_etag(match_id, updated):
+    if updated is None:
+        return None
+
+    return f"match-{match_id}-{updated.timestamp()}"
+
+
+def leaderboard_etag(category_id, revision):
+    if revision is None:
+        return None
+
+    return f"leaderboard-{category_id}-{revision}"
+
+
+def with_teams(matches):
+    """
+    load everything MatchSerializer needs along with `matches`,
+    so a page of matches is always 3 queries (matches, teams, team players)
+    """
+
+    return matches.select_related("category").prefetch_related(
+        Prefetch(
+            "teams",
+            queryset=Team.objects.prefetch_related(
+                Prefetch(
+                    "players",
+                    queryset=TeamPlayer.objects.select_related("player__youtube"),
+                )
+            ),
+        )
+    )
+
+
 class PlayerList(generics.ListCreateAPIView):
     serializer_class = FullPlayerSerializer
 
@@ -136,18 +172,43 @@ class PlayerDetail(generics.RetrieveUpdateDestroyAPIView, mixins.CreateModelMixi
 
         # check if in_queue was changed
         if request.data.get("in_queue") is True:
-            if player.currently_playing_match is not None:
+            if player.currently_playing_match_id is not None:
                 raise APIException("Player is already in a match")
             if player.queues_for.count() == 0:
                 raise APIException("Player is not queueing for a category")
 
             matchmaker.add_player(player)
+        elif request.data.get("in_queue") is False:
+            matchmaker.remove_player(player)
 
         return super(PlayerDetail, self).update(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        was_in_queue = serializer.instance.in_queue
+        super(PlayerDetail, self).perform_update(serializer)
+
+        # only once it's saved, and only if they actually joined or left
+        player = serializer.instance
+        if player.in_queue != was_in_queue:
+            self.publish_queue(
+                player, events.QUEUE_JOINED if player.in_queue else events.QUEUE_LEFT
+            )
+
+    def publish_queue(self, player, type):
+        for category_id in player.queues_for.values_list("category_id", flat=True):
+            events.publish(type, player_id=player.pk, category_id=category_id)
+
 
 class MatchList(generics.ListCreateAPIView):
     serializer_class = MatchSerializer
+    pagination_class = MatchPagination
+
+    def get_serializer_class(self):
+        # lists are read from .values() rows, creating still needs the model serializer
+        if self.request.method == "GET":
+            return MatchRowSerializer
+
+        return MatchSerializer
 
     def get_queryset(self):
         queryset = Match.objects.all()
@@ -160,14 +221,29 @@ class MatchList(generics.ListCreateAPIView):
         if active is not None:
             queryset = queryset.filter(active=True)
 
-        return queryset.order_by("-timestamp_started")
+        return queryset.order_by("-timestamp_started").values(
+            *MatchRowSerializer.values
+        )
 
 
-class MatchDetail(generics.RetrieveUpdateDestroyAPIView):
+class MatchDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = MatchSerializer
 
+    def get_etag(self, request, *args, **kwargs):
+        updated = (
+            Match.objects.filter(match_id=kwargs.get("match_id"))
+            .values_list("updated_timestamp", flat=True)
+            .first()
+        )
+        return match_etag(kwargs.get("match_id"), updated)
+
     def get_object(self):
         match_id = self.kwargs.get("match_id")
+
+        # updates go through the nested serializers, don't hand them stale prefetches
+        if self.request.method == "GET":
+            return get_object_or_404(with_teams(Match.objects), match_id=match_id)
+
         return get_object_or_404(Match, match_id=match_id)
 
     def update(self, request, *args, **kwargs):
@@ -185,17 +261,42 @@ class MatchDetail(generics.RetrieveUpdateDestroyAPIView):
             if old_status == "Result contested":
                 # retroactive result change procedure, just pass for now
                 pass
+            elif old_status == "Finished":
+                # already committed, assign_elo adds the match's change on top of the elo
+                # so doing it again would count the match twice
+                pass
             else:
                 # assign player elos based on the match result
                 assign_elo(match)
 
-        serializer = self.get_serializer(match, data=data, partial=True)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        # the nested serializers save every team and team player on their own,
+        # so resolve their computed fields (team scores etc.) once at the end instead of per save
+        with batch_computed_fields():
+            serializer = self.get_serializer(match, data=data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
 
+        # places need the team scores from above
         match.save()
 
-        return super(MatchDetail, self).update(request, *args, **kwargs)
+        match = get_object_or_404(with_teams(Match.objects), match_id=match.match_id)
+
+        if "teams" in data:
+            events.publish(
+                events.MATCH_SCORES,
+                match_id=match.match_id,
+                category_id=match.category_id,
+            )
+        if match.status != old_status:
+            events.publish(
+                events.MATCH_STATUS,
+                match_id=match.match_id,
+                category_id=match.category_id,
+                status=match.status,
+                old_status=old_status,
+            )
+
+        return Response(self.get_serializer(match).data)
 
 
 class MatchmakeView(generics.ListAPIView):
@@ -206,7 +307,21 @@ class MatchmakeView(generics.ListAPIView):
     )  # this is here so there's no complaining from django
 
     def get(self, request, *args, **kwargs):
-        matches = matchmaker.matchmake()
+        if settings.MATCHMAKING_BACKGROUND:
+            # run_matchmaker makes the matches, just hand out the ones
+            # that don't have a discord thread yet
+            matches = Match.objects.filter(
+                active=True, discord_thread_id__isnull=True
+            ).order_by("match_id")
+
+            after = request.query_params.get("after", None)
+            if after is not None:
+                matches = matches.filter(match_id__gt=after)
+        else:
+            matches = matchmaker.matchmake()
+
+        matches = with_teams(matches)
+
         serializer = self.get_serializer(matches, many=True)
         return Response(serializer.data)
 
@@ -289,7 +404,7 @@ class ChallengeDetail(generics.RetrieveDestroyAPIView):
 
 
 class QueueList(generics.ListAPIView):
-    serializer_class = FullPlayerSerializer
+    serializer_class = QueuePlayerRowSerializer
 
     def get_object(self):
         category_id = self.kwargs.get("category_id")
@@ -297,7 +412,11 @@ class QueueList(generics.ListAPIView):
 
     def get_queryset(self):
         category = self.get_object()
-        return Player.objects.filter(queueing_for=category)
+        return (
+            Player.objects.filter(in_queue=True, queues_for=category)
+            .order_by("queue_joined_timestamp", "discord_id")
+            .values(*QueuePlayerRowSerializer.values)
+        )
 
 
 # class QueueAdd(generics.ListAPIView):
@@ -346,9 +465,23 @@ class QueueList(generics.ListAPIView):
 #         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class LeaderboardDetail(generics.ListAPIView):
-    serializer_class = EloSerializer
-    pagination_class = RankingPagination
+class LeaderboardDetail(
+    ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView
+):
+    serializer_class = EloRowSerializer
+    pagination_class = LeaderboardPagination
+    cache_timeout = settings.CACHE_TIMEOUT_LEADERBOARD
+
+    def get_etag(self, request, *args, **kwargs):
+        revision = (
+            Category.objects.filter(category_id=kwargs.get("category_id"))
+            .values_list("leaderboard_revision", flat=True)
+            .first()
+        )
+        return leaderboard_etag(kwargs.get("category_id"), revision)
+
+    def get_cache_scope(self):
+        return leaderboard_scope(self.kwargs.get("category_id"))
 
     def get_object(self):
         category_id = self.kwargs.get("category_id")
@@ -357,16 +490,21 @@ class LeaderboardDetail(generics.ListAPIView):
     def get_queryset(self):
         category = self.get_object()
 
+        # ranks are kept up to date in rankings.py
         return (
             Elo.objects.filter(category=category)
-            .annotate(rank=Window(expression=Rank(), order_by=F("mu").desc()))
-            .order_by("-mu")
+            .order_by("rank", "pk")
+            .values(*EloRowSerializer.values)
         )
 
 
-class ScoresDetail(generics.ListAPIView):
-    serializer_class = ScoreSerializer
-    pagination_class = RankingPagination
+class ScoresDetail(CachedResponseMixin, generics.ListAPIView):
+    serializer_class = ScoreRowSerializer
+    pagination_class = ScoresPagination
+    cache_timeout = settings.CACHE_TIMEOUT_SCORES
+
+    def get_cache_scope(self):
+        return scores_scope(self.kwargs.get("category_id"))
 
     def get_object(self):
         category_id = self.kwargs.get("category_id")
@@ -375,63 +513,15 @@ class ScoresDetail(generics.ListAPIView):
     def get_queryset(self):
         category = self.get_object()
 
-        """
-        temporary score ranking code.
-        planning on replacing this with custom logic
-        
-        because i dont want to run the window functions
-        every time someone wants a score list, or a single score
-        """
-
         player = self.request.query_params.get("player", None)
         obsolete = self.request.query_params.get("obsolete", None)
 
-        # annotate an overall_rank and player_rank onto all scores
-        scores = (
-            TeamPlayer.objects.filter(category=category, match__status="Finished")
-            .order_by(
-                "score", "match__timestamp_started"
-            )  # order by match start time as well in the event of a tie
-            .annotate(
-                overall_rank=Window(
-                    expression=Rank(),
-                    order_by=F("score").asc(),
-                ),
-                player_rank=Window(
-                    expression=Rank(),
-                    order_by=F("score").asc(),
-                    partition_by=F("player"),
-                ),
-            )
-        )
-
-        # filter by every player's best score
-        # (1 per player because of ties)
-        # (choose the one that happened earliest if a tie exists)
-        best_scores_per_player = scores.order_by(
-            "player",
-            "score",
-            "match__timestamp_started",  # order by match start time as well in the event of a tie
-        ).distinct("player")
-
-        # annotate a non_obsolete_rank onto all best scores per player, else null
-        scores = scores.annotate(
-            non_obsolete_rank=Case(
-                When(
-                    pk__in=Subquery(best_scores_per_player.values("pk")),
-                    then=Window(
-                        expression=Rank(),
-                        order_by=F("score").asc(),
-                    ),
-                ),
-                default=Value(None),
-                output_field=IntegerField(),
-            )
-        )
-
-        # create a cte so that we don't affect the ranks we just made
-        cte = With(scores)
-        scores = cte.queryset().with_cte(cte)
+        # ranks are only set on finished scores, see rankings.py
+        scores = TeamPlayer.objects.filter(
+            category=category, overall_rank__isnull=False
+        ).order_by(
+            "overall_rank", "match_started"
+        )  # order by match start time as well in the event of a tie
 
         if player is not None:
             scores = scores.filter(player__discord_id=player)
@@ -442,19 +532,77 @@ class ScoresDetail(generics.ListAPIView):
             # only show ones that have a non-obsolete rank
             scores = scores.filter(non_obsolete_rank__isnull=False)
 
-        return scores
+        return scores.values(*ScoreRowSerializer.values)
 
 
-class CategoryList(generics.ListAPIView):
+class CategoryList(CachedResponseMixin, generics.ListAPIView):
     serializer_class = CategorySerializer
+    cache_timeout = settings.CACHE_TIMEOUT_CATEGORIES
+
+    def get_cache_scope(self):
+        return CATEGORIES
 
     def get_queryset(self):
         return Category.objects.all()
 
 
-class CategoryDetail(generics.RetrieveAPIView):
+class CategoryDetail(CachedResponseMixin, generics.RetrieveAPIView):
     serializer_class = CategorySerializer
+    cache_timeout = settings.CACHE_TIMEOUT_CATEGORIES
+
+    def get_cache_scope(self):
+        return CATEGORIES
 
     def get_object(self):
         shortcode = self.kwargs.get("shortcode")
         return get_object_or_404(Category, shortcode=shortcode)
+
+
+async def event_stream(request):
+    """
+    server-sent events for matches, queues and leaderboards (see events.py).
+    filter with ?category_id=, ?match_id=, ?player_id= and ?types=match.created,queue.joined
+
+    only streams under asgi.py. under wsgi django would read the whole (endless) stream
+    into memory while holding a worker thread, so it's a 501 there
+    """
+
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "Events need the ASGI app (WEB_ASGI=true)."}, status=501
+        )
+
+    filters = {
+        key: request.GET[key]
+        for key in ("category_id", "match_id", "player_id")
+        if key in request.GET
+    }
+    types = request.GET.get("types")
+    types = set(types.split(",")) if types else None
+
+    async def stream():
+        with events.get_broadcaster().subscribe() as subscription:
+            # how long clients wait before reconnecting, in ms
+            yield "retry: 5000\n\n"
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(), timeout=settings.EVENTS_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+
+                if types is not None and event["type"] not in types:
+                    continue
+
+                if events.event_matches(event, filters):
+                    yield events.format_event(event)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
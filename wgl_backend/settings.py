@@ -184,3 +184,65 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 APPEND_SLASH = True
+
+# Matchmaking
+# where the queue delay counter and matchmaking locks live.
+# use "wgl_api.queue_state.InMemoryQueueState" to keep them in process memory (single worker only)
+
+MATCHMAKING_QUEUE_STATE = get_secret(
+    "MATCHMAKING_QUEUE_STATE", "wgl_api.queue_state.DatabaseQueueState"
+)
+
+# when true, matches are made by `python manage.py run_matchmaker`
+# and GET /matchmake only returns the matches the bot hasn't made a thread for yet
+MATCHMAKING_BACKGROUND = get_secret("MATCHMAKING_BACKGROUND", "false").lower() == "true"
+
+MATCHMAKING_TICK_SECONDS = float(get_secret("MATCHMAKING_TICK_SECONDS", "5"))
+
+# Events
+# what fans out the realtime events on GET /v1/events. the default only reaches
+# streams connected to the same process, see wgl_api/events.py
+
+EVENTS_BROADCASTER = get_secret(
+    "EVENTS_BROADCASTER", "wgl_api.events.InMemoryBroadcaster"
+)
+
+EVENTS_KEEPALIVE_SECONDS = float(get_secret("EVENTS_KEEPALIVE_SECONDS", "15"))
+
+# serve the busiest GET endpoints with the async views in wgl_api/async_views.py.
+# only worth it under asgi.py, under wsgi every async view gets its own event loop
+ASYNC_READ_VIEWS = get_secret("ASYNC_READ_VIEWS", "false").lower() == "true"
+
+# Cache
+# set REDIS_URL (eg. redis://redis:6379/0) to share the cache between workers,
+# or CACHE_DIR to keep it on disk. otherwise every process gets its own in-memory cache
+
+REDIS_URL = get_secret("REDIS_URL", None)
+CACHE_DIR = get_secret("CACHE_DIR", None)
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# how long (in seconds) cached responses live. they're also dropped as soon as
+# the data changes, this is just an upper bound for changes nothing invalidates (eg. usernames)
+CACHE_TIMEOUT_CATEGORIES = int(get_secret("CACHE_TIMEOUT_CATEGORIES", "3600"))
+CACHE_TIMEOUT_LEADERBOARD = int(get_secret("CACHE_TIMEOUT_LEADERBOARD", "300"))
+CACHE_TIMEOUT_SCORES = int(get_secret("CACHE_TIMEOUT_SCORES", "300"))